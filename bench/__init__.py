@@ -0,0 +1,112 @@
+# Benchmarks of the wake-up light, run on the host with the fakes of the sim
+# package: python -m bench (all of them) or python -m bench.bench_fade, ...
+#
+# Each benchmark reports the time per step (mean, 99th percentile, worst)
+# and the memory allocated per step, measured in a second pass with
+# tracemalloc so the tracing does not skew the timings. The numbers are host
+# numbers: use them to compare changes, not as ESP32 figures.
+#
+# measure() and report() also run on the board (without the allocations),
+# for the benchmarks that do not need the sim, e.g. bench_spatial.
+
+import os
+import sys
+
+try:
+    from time import perf_counter_ns
+
+    def _now():
+        return perf_counter_ns()
+
+    def _us(t):
+        return (perf_counter_ns() - t) / 1000
+except ImportError:
+    # MicroPython
+    import utime
+
+    _now = utime.ticks_us
+
+    def _us(t):
+        return utime.ticks_diff(utime.ticks_us(), t)
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class Result:
+    '''
+    Timings in us and allocations in bytes (None if not measured) of one
+    benchmark
+    '''
+
+    def __init__(self, name, times, alloc, **extra):
+        self.name = name
+        times = sorted(times)
+        self.steps = len(times)
+        self.mean = sum(times) / len(times) if times else 0
+        self.p99 = times[min(len(times) - 1, len(times) * 99 // 100)] if times else 0
+        self.worst = times[-1] if times else 0
+        self.alloc = alloc
+        self.extra = extra
+
+    def __str__(self):
+        line = f'{self.name:34s} {self.mean:9.1f} us  p99 {self.p99:9.1f} us  max {self.worst:9.1f} us'
+        if self.alloc is not None:
+            line += f'  {self.alloc:7.0f} B/step'
+        for key, value in self.extra.items():
+            line += f'  {key} {value}'
+        return line
+
+
+def measure(name, step, steps, setup=None, **extra):
+    '''
+    Call step(i) for i in range(steps), after setup() if given, once for
+    the timings and once more, after a new setup(), for the allocations
+    (not measured where there is no tracemalloc)
+    '''
+    if setup is not None:
+        setup()
+    times = []
+    for i in range(steps):
+        t = _now()
+        step(i)
+        times.append(_us(t))
+    if tracemalloc is None:
+        return Result(name, times, None, **extra)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    allocated = 0
+    try:
+        for i in range(steps):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            step(i)
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return Result(name, times, allocated / steps if steps else 0, **extra)
+
+
+class quiet:
+    '''
+    Context manager hiding the output of the app (the effects print their
+    progress) while benchmarking it
+    '''
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+def report(title, results):
+    print(title)
+    for result in results:
+        print(f'  {result}')
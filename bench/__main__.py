@@ -0,0 +1,6 @@
+# Run every benchmark: python -m bench (from the repository root)
+
+from bench import bench_fade, bench_sunrise, bench_spatial, bench_dispatch, bench_messages, bench_publish
+
+for module in (bench_fade, bench_sunrise, bench_spatial, bench_dispatch, bench_messages, bench_publish):
+    module.main()
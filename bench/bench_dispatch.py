@@ -0,0 +1,63 @@
+# Per-message cost of finding the handler of an MQTT message: the topic
+# table of NeoPixelMQTT.dispatch() against the if/elif chain it replaced,
+# which decoded the topic and built an f-string for every branch. The
+# handlers are stubbed out so only the dispatch is measured.
+#
+# python -m bench.bench_dispatch (from the repository root)
+
+import sim
+
+from bench import measure, quiet, report
+
+MESSAGES = 1000
+
+
+def bench():
+    sim.install()
+    from secrets import mqtt_config
+    from mqtt import NeoPixelMQTT
+    from light import NeoPixelLight
+    neo = NeoPixelLight(16, 30)
+    neo_mqtt = NeoPixelMQTT(neo, dht_config={}, btn_config={'btn_pin': 0}, mqtt_config=mqtt_config,
+                            wifi_config={'ssid': 'sim', 'wifi_pw': ''})
+    prefix = neo_mqtt.topic_prefix
+    handled = []
+    for topic in neo_mqtt.handlers:
+        neo_mqtt.handlers[topic] = handled.append
+    
+    def chain(topic, msg):
+        # the former messages() body, minus the handlers
+        topic = topic.decode('utf-8')
+        msg = msg.decode('utf-8')
+        print(f'topic: {topic} -- message: {msg}')
+        for name in NeoPixelMQTT.topics:
+            if topic == f'{prefix}/{name}':
+                handled.append(msg)
+                return True
+        return False
+    
+    def run(dispatch, topic):
+        topic = bytearray(f'{prefix}/{topic}'.encode())
+        msg = bytearray(b'1')
+        
+        def step(i):
+            dispatch(topic, msg)
+        return step
+    
+    results = []
+    # first and last topic of the chain, and a message the lamp published
+    # itself, which comes back through the prefix/# subscription
+    for topic in ('toggle_light', 'publish_updates', 'light_on'):
+        for name, dispatch in (('table', neo_mqtt.dispatch), ('if/elif chain', chain)):
+            results.append(measure(f'{topic} {name}', run(dispatch, topic), MESSAGES, handled.clear))
+    return results
+
+
+def main():
+    with quiet():
+        results = bench()
+    report(f'dispatch ({MESSAGES} messages)', results)
+
+
+if __name__ == '__main__':
+    main()
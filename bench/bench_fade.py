@@ -0,0 +1,52 @@
+# Per-frame cost of a color fade driven by the compositor, plus the cost of
+# building its frame table, for a few strip lengths.
+#
+# python -m bench.bench_fade (from the repository root)
+
+import sim
+
+from bench import measure, quiet, report
+
+STRIP_PIN = 16
+FPS = 30
+
+
+def bench(num_leds, seconds=10):
+    clock, _ = sim.install()
+    import light
+    from light import NeoPixelLight, fade_table
+    neo = NeoPixelLight(STRIP_PIN, num_leds)
+    # keep the fake strip from recording the frames it is sent
+    neo.np.record = False
+    frame_s = 1 / FPS
+    frames = int(seconds * FPS)
+    
+    def setup():
+        neo.cancel()
+        neo.start(neo.fade((255,153,51,0), seconds), name='fade', duration_ms=seconds * 1000)
+    
+    def step(i):
+        clock.advance(frame_s)
+        neo.render()
+    
+    def build(i):
+        light._fade_cache.clear()
+        light._fade_keys.clear()
+        fade_table((0,0,0,0), (255,153,51,0), 500)
+    
+    return [
+        measure(f'{num_leds} leds fade frame', step, frames, setup),
+        measure(f'{num_leds} leds fade table (500 steps)', build, 20),
+    ]
+
+
+def main():
+    results = []
+    for num_leds in (30, 144, 300):
+        with quiet():
+            results += bench(num_leds)
+    report('fade', results)
+
+
+if __name__ == '__main__':
+    main()
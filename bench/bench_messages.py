@@ -0,0 +1,80 @@
+# Cost of handling the MQTT commands in the running app: each command is
+# sent through the broker stand-in and the run measures the host time spent
+# over an idle window of the same length, the messages (and bytes of topics
+# and payloads) the device publishes in response and the virtual time to its
+# first answer, averaged over the runs. Commands setting a value cycle
+# through payloads that each change it, so that no run is a no-op.
+#
+# python -m bench.bench_messages (from the repository root)
+
+import time
+
+from bench import Result, report
+from sim.run import simulate
+
+WINDOW = 5 # seconds of virtual time given to each command
+REPEAT = 5
+COMMANDS = (
+    ('publish_updates', ('',)),
+    ('set_brightness', ('0.4', '0.8')),
+    ('toggle_light', ('',)),
+    ('set_rgbw', ('#ff9933', '#3399ff')),
+    ('set_alarm_time', ('06:30', '06:45')),
+    ('toggle_alarm', ('',)),
+    ('set_profile', ('sunrise_glow', 'sunrise')),
+    ('snooze', ('5',)),
+    ('dismiss', ('',)),
+)
+
+
+async def scenario(app, results):
+    import uasyncio
+    clock = app.clock
+    broker = app.broker
+    prefix = app.neo_mqtt.topic_prefix
+    # let the app connect, subscribe and settle
+    await uasyncio.sleep(60)
+    
+    async def window(topic=None, msg=''):
+        sent = len(broker.published)
+        t0 = clock.monotonic()
+        t = time.perf_counter_ns()
+        if topic is not None:
+            broker.publish(f'{prefix}/{topic}', msg)
+        await uasyncio.sleep(WINDOW)
+        spent = (time.perf_counter_ns() - t) / 1000
+        # the device's own messages come back to it through prefix/#,
+        # count only the ones it published
+        answers = [m for m in broker.published[sent:] if m[1] != f'{prefix}/{topic}']
+        first = (answers[0][0] - int(t0 * 1000)) if answers else None
+        size = sum(len(m[1]) + len(m[2]) for m in answers)
+        return spent, len(answers), size, first
+    
+    idle = [(await window())[0] for _ in range(REPEAT)]
+    baseline = sum(idle) / len(idle)
+    for topic, msgs in COMMANDS:
+        times = []
+        counts = []
+        for i in range(REPEAT):
+            spent, answers, size, first = await window(topic, msgs[i % len(msgs)])
+            times.append(max(0, spent - baseline))
+            counts.append((answers, size, first))
+        answered = [c[2] for c in counts if c[2] is not None]
+        results.append(Result(topic, times, None,
+                              published=sum(c[0] for c in counts) / REPEAT,
+                              bytes=sum(c[1] for c in counts) / REPEAT,
+                              first_ms=sum(answered) // len(answered) if answered else None))
+
+
+def main():
+    results = []
+    
+    async def run(app):
+        await scenario(app, results)
+    
+    simulate(60 + WINDOW * REPEAT * (len(COMMANDS) + 1) + 1, run, start='2024-03-01T12:00', quiet=True)
+    report(f'messages (host time over idle, {REPEAT} runs each)', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# Latency of a full state refresh (the messages of publish_updates) sent
+# with qos 1 to the broker stand-in, one publish() after the other versus
+# publish_many() with a small window and with the app's one, for a few
+# broker round trip times. Times are virtual: the sim delays every packet
+# by the round trip time.
+#
+# python -m bench.bench_publish (from the repository root)
+
+from bench import Result, report
+from sim.run import simulate
+
+REFRESH = 15 # messages in a refresh
+REPEAT = 5
+
+
+async def scenario(app, results, rtt_ms):
+    import uasyncio
+    clock = app.clock
+    client = app.neo_mqtt.client
+    prefix = app.neo_mqtt.topic_prefix
+    # let the app connect, subscribe and settle
+    await uasyncio.sleep(60)
+    msgs = [(f'{prefix}/bench_{i}', f'{i}') for i in range(REFRESH)]
+    
+    async def sequential():
+        for topic, msg in msgs:
+            await client.publish(topic, msg, qos=1)
+    
+    async def pipelined():
+        await client.publish_many(msgs, qos=1)
+    
+    async def window_4():
+        await client.publish_many(msgs, qos=1, window=4)
+    
+    for name, refresh in (('publish', sequential), ('publish_many window 4', window_4), ('publish_many', pipelined)):
+        times = []
+        for _ in range(REPEAT):
+            t = clock.monotonic()
+            await refresh()
+            times.append((clock.monotonic() - t) * 1000000)
+            await uasyncio.sleep(1)
+        results.append(Result(f'rtt {rtt_ms} ms {name}', times, None, repubs=client.REPUB_COUNT))
+
+
+def main():
+    results = []
+    for rtt_ms in (5, 20, 100):
+        async def run(app):
+            await scenario(app, results, rtt_ms)
+        simulate(60 + 3 * REPEAT * 4, run, start='2024-03-01T12:00', rtt_ms=rtt_ms, quiet=True)
+    report(f'publish ({REFRESH} qos 1 messages, virtual time)', results)
+
+
+if __name__ == '__main__':
+    main()
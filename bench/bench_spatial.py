@@ -0,0 +1,58 @@
+# Per-frame cost of the spatial (per-pixel) scene effects compared with the
+# uniform fill, at full and half brightness, for a few strip lengths.
+#
+# On the host: python -m bench.bench_spatial (from the repository root),
+# the viper passes of light.py then run as plain Python.
+# On the board: copy bench/__init__.py and this file to a bench directory
+# next to light.py, then import bench.bench_spatial and call main(); the
+# real strip is written.
+
+import sys
+
+from bench import measure, report
+
+ON_BOARD = sys.implementation.name == 'micropython'
+
+STRIP_PIN = 16
+FRAMES = 200
+
+
+def bench(num_leds):
+    if not ON_BOARD:
+        import sim
+        sim.install()
+    from light import NeoPixelLight, SHAPES, distance_table, fade_table
+    neo = NeoPixelLight(STRIP_PIN, num_leds)
+    if not ON_BOARD:
+        # keep the fake strip from recording the frames it is sent
+        neo.np.record = False
+    table = fade_table((0,0,0,0), (255,153,51,0), FRAMES)
+    colors = [tuple(table[i * 4:i * 4 + 4]) for i in range(FRAMES)]
+    
+    def uniform(step):
+        neo.fill(colors[step])
+        neo.show()
+    
+    results = [measure(f'{num_leds} leds uniform', uniform, FRAMES)]
+    neo.set_brightness(.5)
+    results.append(measure(f'{num_leds} leds uniform 50%', uniform, FRAMES))
+    neo.set_brightness(1)
+    for shape, (origin, reach_start) in SHAPES.items():
+        def spatial(step):
+            # the distance table lookup is part of each frame, as in the effect
+            distances = distance_table(origin, neo.np.n - neo.led0)
+            neo.shade(colors[step], distances, reach_start + (510 - reach_start) * step // FRAMES)
+            neo.show()
+        results.append(measure(f'{num_leds} leds {shape}', spatial, FRAMES))
+    return results
+
+
+def main():
+    results = []
+    for num_leds in (30, 144, 300):
+        results += bench(num_leds)
+    report('spatial', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Per-frame cost of the keyframe sunrise profiles, uniform and spatial, at
+# the compositor frame rate: a 20 minutes sunrise is 36000 frames at 30 fps.
+#
+# python -m bench.bench_sunrise (from the repository root)
+
+import sim
+
+from bench import measure, quiet, report
+
+STRIP_PIN = 16
+FPS = 30
+DURATION = 20 * 60
+
+
+def bench(num_leds, profiles):
+    clock, _ = sim.install()
+    from light import NeoPixelLight
+    neo = NeoPixelLight(STRIP_PIN, num_leds)
+    # keep the fake strip from recording the frames it is sent
+    neo.np.record = False
+    frame_s = 1 / FPS
+    frames = DURATION * FPS
+    
+    results = []
+    for name in profiles:
+        def setup():
+            neo.cancel()
+            neo.profile_tables.clear()
+            neo.start(neo.profile_effect(name, DURATION), name=name, duration_ms=DURATION * 1000)
+        
+        def step(i):
+            clock.advance(frame_s)
+            neo.render()
+        
+        written = neo.frames_written
+        result = measure(f'{num_leds} leds {name}', step, frames, setup)
+        result.extra['shown'] = (neo.frames_written - written) // 2
+        results.append(result)
+    return results
+
+
+def main():
+    profiles = ('sunrise', 'sunrise_soft', 'sunrise_glow', 'sunrise_horizon')
+    results = []
+    for num_leds in (30, 144):
+        with quiet():
+            results += bench(num_leds, profiles)
+    report(f'sunrise ({DURATION} s at {FPS} fps)', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,19 @@
 #import webrepl
 #webrepl.start()
 
+from startup import STARTUP
+STARTUP.mark('boot')
+
+from light import NeoPixelLight
+
+STRIP_PIN = 16
+NUM_LEDS = 30
+
+# bring the light back to its state before the reset right away, before
+# wifi and mqtt take their seconds to connect
+neo = NeoPixelLight(STRIP_PIN, NUM_LEDS)
+STARTUP.mark('light')
+
 from wifi import do_connect, do_disconnect
 
 start = False
@@ -13,6 +26,7 @@ try:
     print('Wifi configuration saved, disconnecting now...')
     start = True
     do_disconnect()
+    STARTUP.mark('wifi')
 except:
     print('Error: no wifi connectivity')
     
\ No newline at end of file
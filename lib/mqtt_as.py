@@ -93,6 +93,7 @@ config = {
     "clean_init": True,
     "clean": True,
     "max_repubs": 4,
+    "pub_window": 8,  # qos 1 publications in flight in publish_many()
     "will": None,
     "subs_cb": lambda *_: None,
     "wifi_coro": eliza,
@@ -137,6 +138,7 @@ class MQTT_base:
             raise ValueError("invalid keepalive time")
         self._response_time = config["response_time"] * 1000  # Repub if no PUBACK received (ms).
         self._max_repubs = config["max_repubs"]
+        self._pub_window = config["pub_window"]
         self._clean_init = config["clean_init"]  # clean_session state on first connection
         self._clean = config["clean"]  # clean_session state on reconnect
         will = config["will"]
@@ -223,6 +225,8 @@ class MQTT_base:
                 size += msg_size
                 t = ticks_ms()
                 self.last_rx = ticks_ms()
+                if size == n:  # Complete: no need to poll again
+                    break
             await asyncio.sleep_ms(_SOCKET_POLL_DELAY)
         return data
 
@@ -247,6 +251,8 @@ class MQTT_base:
             if n:
                 t = ticks_ms()
                 bytes_wr = bytes_wr[n:]
+                if not bytes_wr:  # All written: no need to poll again
+                    break
             await asyncio.sleep_ms(_SOCKET_POLL_DELAY)
 
     async def _send_str(self, s):
@@ -418,6 +424,45 @@ class MQTT_base:
             count += 1
             self.REPUB_COUNT += 1
 
+    # Pipelined publication of a list of (topic, msg): up to window qos 1
+    # messages are sent without awaiting their PUBACK, which are collected
+    # together, so a burst costs about one round trip instead of one each.
+    # Acknowledged (or, qos 0, sent) messages are removed from the list, so
+    # on OSError the subclass re-publishes the rest only.
+    async def publish_many(self, msgs, retain, qos, window):
+        pending = {}  # pid: [(topic, msg), time sent, repubs]
+        i = 0  # Next message to send
+        while i < len(msgs) or pending:
+            while i < len(msgs) and len(pending) < window:
+                topic, msg = msgs[i]
+                pid = next(self.newpid)
+                if qos:
+                    self.rcv_pids.add(pid)
+                    pending[pid] = [msgs[i], ticks_ms(), 0]
+                async with self.lock:
+                    await self._publish(topic, msg, retain, qos, 0, pid)
+                if qos:
+                    i += 1
+                else:
+                    msgs.pop(i)
+            if not pending:
+                continue
+            await asyncio.sleep_ms(_SOCKET_POLL_DELAY)
+            for pid in list(pending):
+                entry = pending[pid]
+                if pid not in self.rcv_pids:  # PUBACK received
+                    del pending[pid]
+                    msgs.remove(entry[0])
+                    i -= 1
+                elif self._timeout(entry[1]) or not self.isconnected():
+                    if entry[2] >= self._max_repubs or not self.isconnected():
+                        raise OSError(-1)  # Subclass to re-publish the rest
+                    async with self.lock:
+                        await self._publish(*entry[0], retain, qos, dup=1, pid=pid)
+                    entry[1] = ticks_ms()
+                    entry[2] += 1
+                    self.REPUB_COUNT += 1
+
     async def _publish(self, topic, msg, retain, qos, dup, pid):
         pkt = bytearray(b"\x30\0\0\0")
         pkt[0] |= qos << 1 | retain | dup << 3
@@ -432,12 +477,19 @@ class MQTT_base:
             sz >>= 7
             i += 1
         pkt[i] = sz
-        await self._as_write(pkt, i + 1)
-        await self._send_str(topic)
+        # Whole packet in one write: each write costs a socket poll delay
+        n = i + 1
+        buf = bytearray(n + 2 + len(topic) + (2 if qos > 0 else 0) + len(msg))
+        buf[:n] = pkt[:n]
+        struct.pack_into("!H", buf, n, len(topic))
+        n += 2
+        buf[n:n + len(topic)] = memoryview(topic)
+        n += len(topic)
         if qos > 0:
-            struct.pack_into("!H", pkt, 0, pid)
-            await self._as_write(pkt, 2)
-        await self._as_write(msg)
+            struct.pack_into("!H", buf, n, pid)
+            n += 2
+        buf[n:] = memoryview(msg)
+        await self._as_write(buf)
 
     # Can raise OSError if WiFi fails. Subclass traps.
     async def subscribe(self, topic, qos):
@@ -486,7 +538,7 @@ class MQTT_base:
 
         if res == b"\xd0":  # PINGRESP
             await self._as_read(1)  # Update .last_rx time
-            return
+            return True
         op = res[0]
 
         if op == 0x40:  # PUBACK: save pid
@@ -519,7 +571,7 @@ class MQTT_base:
                 raise OSError(-1)
 
         if op & 0xF0 != 0x30:
-            return
+            return True
         sz = await self._recv_len()
         topic_len = await self._as_read(2)
         topic_len = (topic_len[0] << 8) | topic_len[1]
@@ -541,6 +593,7 @@ class MQTT_base:
             await self._as_write(pkt)
         elif op & 6 == 4:  # qos 2 not supported
             raise OSError(-1, "QoS 2 not supported")
+        return True
 
 
 # MQTTClient class. Handles issues relating to connectivity.
@@ -673,8 +726,10 @@ class MQTTClient(MQTT_base):
         try:
             while self.isconnected():
                 async with self.lock:
-                    await self.wait_msg()  # Immediate return if no message
-                await asyncio.sleep_ms(_DEFAULT_MS)  # Let other tasks get lock
+                    busy = await self.wait_msg()  # Immediate return if no message
+                # Let other tasks get lock, at once while a burst (e.g. the
+                # PUBACKs of publish_many) is coming in
+                await asyncio.sleep_ms(0 if busy else _DEFAULT_MS)
 
         except OSError:
             pass
@@ -791,3 +846,15 @@ class MQTTClient(MQTT_base):
             except OSError:
                 pass
             self._reconnect()  # Broker or WiFi fail.
+
+    async def publish_many(self, msgs, retain=False, qos=0, window=None):
+        qos_check(qos)
+        msgs = list(msgs)  # Emptied as the messages are acknowledged
+        window = self._pub_window if window is None else window
+        while 1:
+            await self._connection()
+            try:
+                return await super().publish_many(msgs, retain, qos, window)
+            except OSError:
+                pass
+            self._reconnect()  # Broker or WiFi fail.
@@ -1,11 +1,307 @@
-import gc
-gc.enable()
-gc.collect()
-
-from machine import Pin
+from machine import Pin, RTC
 import neopixel
 import utime
 import uasyncio
+import ujson
+import ustruct
+import ubinascii
+import micropython
+
+
+FADE_CACHE_SIZE = 8 # max number of fade tables kept in memory
+
+_fade_cache = {}
+_fade_keys = []
+
+def fade_table(start_color: tuple, color: tuple, steps: int):
+    '''
+    Return the frames of a linear fade as a flat bytearray of (steps + 1)
+    RGBW quadruplets, computed once with 16.16 fixed-point integer math.
+    Tables are cached on the (start_color, color, steps) segment so repeated
+    fades reuse them.
+    '''
+    steps = max(1, steps)
+    key = (tuple(start_color), tuple(color), steps)
+    table = _fade_cache.get(key)
+    if table is not None:
+        return table
+    
+    table = bytearray((steps + 1) * 4)
+    for c in range(4):
+        start = start_color[c]
+        acc = (start << 16) + 0x8000 # +0.5 to round to nearest
+        inc = ((color[c] - start) << 16) // steps
+        for i in range(c, steps * 4, 4):
+            table[i] = acc >> 16
+            acc += inc
+        # last frame is exactly the target color
+        table[steps * 4 + c] = color[c]
+    
+    if len(_fade_keys) >= FADE_CACHE_SIZE:
+        del _fade_cache[_fade_keys.pop(0)]
+    _fade_cache[key] = table
+    _fade_keys.append(key)
+    return table
+
+
+PROFILE_STEPS = 1000 # frames in a compiled sunrise/sunset profile
+
+_easing_tables = {}
+
+def easing_table(easing: str):
+    '''
+    Return a 256 entries bytearray mapping the linear progress within a
+    segment (0-255) to the eased progress (0-255)
+    '''
+    table = _easing_tables.get(easing)
+    if table is not None:
+        return table
+    
+    table = bytearray(256)
+    for u in range(256):
+        if easing == 'linear':
+            e = u
+        elif easing == 'ease_in':
+            e = u * u // 255
+        elif easing == 'ease_out':
+            e = 255 - (255 - u) * (255 - u) // 255
+        elif easing == 'ease_in_out':
+            e = u * u * (765 - 2 * u) // 65025 # smoothstep
+        else:
+            raise ValueError(f'Unknown easing: {easing}')
+        table[u] = e
+    _easing_tables[easing] = table
+    return table
+
+def compile_profile(stops: list, easing='linear', steps=PROFILE_STEPS):
+    '''
+    Compile a keyframe profile, i.e. a list of (time fraction, RGBW) stops
+    sorted by time, into a flat bytearray of (steps + 1) RGBW frames like
+    fade_table. Two stops at the same time make a jump in color.
+    '''
+    ease = easing_table(easing)
+    # stops at the same time keep their order (MicroPython's sort is not
+    # stable, hence the index)
+    points = sorted((int(t * 65536), i, tuple(color)) for i, (t, color) in enumerate(stops))
+    points = [(pos, color) for pos, i, color in points]
+    if points[0][0] > 0:
+        points.insert(0, (0, points[0][1]))
+    if points[-1][0] < 65536:
+        points.append((65536, points[-1][1]))
+    
+    table = bytearray((steps + 1) * 4)
+    seg = 0
+    for frame in range(steps + 1):
+        pos = frame * 65536 // steps
+        while seg < len(points) - 2 and pos >= points[seg + 1][0]:
+            seg += 1
+        a_pos, a_color = points[seg]
+        b_pos, b_color = points[seg + 1]
+        span = b_pos - a_pos
+        e = ease[min(255, (pos - a_pos) * 255 // span)] if span > 0 else 255
+        i = frame * 4
+        for c in range(4):
+            table[i + c] = a_color[c] + (b_color[c] - a_color[c]) * e // 255
+    return table
+
+
+# spatial shapes: where the light comes from and how far it initially
+# reaches (0-510), see NeoPixelLight.shade
+SHAPES = {
+    'glow_start': ('start', 0), # glow spreading from led0
+    'glow_end': ('end', 0), # glow spreading from the last led
+    'glow_center': ('center', 0), # glow spreading from the middle
+    'horizon': ('start', 255) # gradient rising from led0
+    }
+
+_distance_tables = {}
+
+def distance_table(origin: str, n: int):
+    '''
+    Return a bytearray with the distance (0-255) of each of n pixels from
+    the origin of the light: 'start', 'end' or 'center'
+    '''
+    key = (origin, n)
+    table = _distance_tables.get(key)
+    if table is not None:
+        return table
+    
+    last = max(1, n - 1)
+    table = bytearray(n)
+    for p in range(n):
+        if origin == 'start':
+            d = p * 255 // last
+        elif origin == 'end':
+            d = (last - p) * 255 // last
+        elif origin == 'center':
+            d = abs(2 * p - last) * 255 // last
+        else:
+            raise ValueError(f'Unknown origin: {origin}')
+        table[p] = d
+    _distance_tables[key] = table
+    return table
+
+
+def brightness_table(level: int, gamma=False):
+    '''
+    Return a 256 entries bytearray scaling a color component by level
+    (0-255), optionally gamma-corrected
+    '''
+    table = bytearray(256)
+    for v in range(256):
+        # float math is fine here: the table is only rebuilt on changes
+        linear = int((v / 255) ** 2.2 * 255 + .5) if gamma else v
+        table[v] = (linear * level + 127) // 255
+    return table
+
+
+# per-pixel passes over the frame buffer, compiled to machine code by the
+# viper emitter: at 300 leds the bytecode loops would take several frames
+# worth of time on the board
+
+@micropython.viper
+def _shade(buf, distances, color, reach: int):
+    '''
+    Write color (in strip order) to the pixels of buf, each one scaled by
+    min(255, max(0, reach - distance)) / 256
+    '''
+    n = int(len(distances))
+    bpp = int(len(color))
+    p = ptr8(buf)
+    d = ptr8(distances)
+    c = ptr8(color)
+    i = 0
+    for j in range(n):
+        w = reach - d[j]
+        if w < 0:
+            w = 0
+        elif w > 254:
+            w = 256
+        if bpp == 4:
+            p[i] = (c[0] * w) >> 8
+            p[i + 1] = (c[1] * w) >> 8
+            p[i + 2] = (c[2] * w) >> 8
+            p[i + 3] = (c[3] * w) >> 8
+        else:
+            for k in range(bpp):
+                p[i + k] = (c[k] * w) >> 8
+        i += bpp
+
+@micropython.viper
+def _scale(out, frame, lut):
+    '''
+    out[i] = lut[frame[i]] for every byte of the frame
+    '''
+    n = int(len(frame))
+    o = ptr8(out)
+    f = ptr8(frame)
+    t = ptr8(lut)
+    for i in range(n):
+        o[i] = t[f[i]]
+
+
+class FrameScheduler:
+    '''
+    Pace the frames of a timed animation against absolute ticks_ms
+    deadlines: frame i is due at start + duration * i / frames. Time spent
+    rendering does not push the schedule back; when running late the
+    overdue frames are dropped so the last frame still lands on time.
+    An animation resumed part way through (start in the past) begins at
+    the frame due at now, the frames before it are neither dropped nor late.
+    '''
+    
+    def __init__(self, duration_ms: int, frames: int, start_ms=None, now=None):
+        self.start = utime.ticks_ms() if start_ms is None else start_ms
+        self.duration = max(0, int(duration_ms))
+        self.frames = max(1, frames)
+        self.next = self.frame_at(self.start if now is None else now)
+        
+        self.rendered = 0
+        self.dropped = 0
+        self.max_late = 0 # worst lateness in ms
+    
+    def deadline(self, frame: int):
+        return utime.ticks_add(self.start, self.duration * frame // self.frames)
+    
+    def frame_at(self, now: int):
+        '''
+        Index of the most recent frame due at ticks_ms now
+        '''
+        elapsed = utime.ticks_diff(now, self.start)
+        if elapsed >= self.duration:
+            return self.frames
+        return max(0, elapsed * self.frames // self.duration)
+    
+    def due(self, now: int):
+        '''
+        Return the index of the frame to render at ticks_ms now, None if
+        the next frame is not due yet and -1 when the animation is over
+        '''
+        frame = self.next
+        if frame > self.frames:
+            return -1
+        
+        late = utime.ticks_diff(now, self.deadline(frame))
+        if late < 0:
+            return None
+        
+        # skip to the most recent frame already due
+        due = self.frame_at(now)
+        if due > frame:
+            self.dropped += due - frame
+            frame = due
+        if late > self.max_late:
+            self.max_late = late
+        
+        self.next = frame + 1
+        self.rendered += 1
+        return frame
+    
+    def report(self):
+        return f'{self.rendered} frames rendered, {self.dropped} dropped, worst lateness {self.max_late} ms'
+
+
+class Animation:
+    '''
+    Registry entry of the effect running on a compositor layer
+    '''
+    
+    def __init__(self, name: str, effect, duration_ms=0, start_ms=None):
+        self.name = name
+        self.effect = effect
+        self.duration = int(duration_ms)
+        self.start = utime.ticks_ms() if start_ms is None else start_ms
+    
+    def elapsed(self, now: int):
+        return utime.ticks_diff(now, self.start)
+    
+    def progress(self, now: int):
+        '''
+        Percentage of the animation done, 0 if it has no fixed duration
+        '''
+        if self.duration <= 0:
+            return 0
+        return min(100, max(0, self.elapsed(now) * 100 // self.duration))
+    
+    def eta(self, now: int):
+        '''
+        Seconds left before the end of the animation
+        '''
+        return max(0, self.duration - self.elapsed(now)) // 1000
+
+
+# compositor layers, in rendering order
+SCENE = 0 # main strip, from led0 to the last led
+STATUS = 1 # status led i.e. led 0
+OVERLAY = 2 # whole strip, drawn on top of everything
+
+# checkpoint of the light state: magic, RGBW, brightness level, flags,
+# start (RTC seconds) and duration (ms) of the running profile and its name,
+# followed by the CRC32 of all that
+CHECKPOINT_FORMAT = '<2s4BBBiI16s'
+CHECKPOINT_MAGIC = b'L1'
+CHECKPOINT_FILE = 'light.bin'
+CHECKPOINT_GAMMA = 1 # flags
 
 
 class NeoPixelLight:
@@ -20,20 +316,63 @@ class NeoPixelLight:
         'purple': (255, 0, 255, 0),
         'sun': (255, 64, 0, 0)
         }
+    
+    # keyframe profiles: (time fraction, RGBW) stops and an easing curve,
+    # can be overridden or extended in profiles.json
+    profiles = {
+        'sunrise': {
+            'easing': 'linear',
+            'stops': [(0, (0,0,0,0)), (.1, (36,24,4,0)), (.8, (255,64,0,0)), (1, (255,153,51,0))]
+            },
+        'sunset': {
+            'easing': 'linear',
+            'stops': [(0, (255,153,51,0)), (.2, (255,64,0,0)), (.9, (36,24,4,0)), (1, (0,0,0,0))]
+            }
+        }
 
     def __init__(self, pin: int, num_leds: int, bpp=4):
         self.np = neopixel.NeoPixel(pin=Pin(pin), n=num_leds, bpp=bpp)
+        # frame buffer the effects draw into, scaled into np.buf by show()
+        self.frame = bytearray(len(self.np.buf))
+        self.buf = memoryview(self.frame)
+        self.last_frame = None # copy of the last frame sent to the strip
+        self.drawn = False # the frame buffer was drawn into since the last show()
+        self.shade_color = bytearray(bpp) # color of shade() in strip order
+        self.frames_written = 0
+        self.frames_suppressed = 0
         self.led0 = 1
         self.heartbeat_on = True
         self.current_color = (0,0,0,0)
         self.brightness = 1.0 # 0 to 1 i.e. 0 to 255
+        self.gamma = False
+        self.brightness_lut = None # None when brightness is 1 without gamma
+        self.brightness_changed = False
         self.light_on = False # by default at startup the light is off
+        self.fade_stats = (0, 0, 0) # frames rendered, dropped, worst lateness (ms) of the last fade
+        
+        # effects are generators advanced once per frame by the compositor,
+        # one per layer; an empty scene layer shows current_color
+        self.layers = [None, None, None]
+        self.animations = [None, None, None] # registry of the running effects
+        self.scene_color = None # color the empty scene layer last filled
+        self.repaints = 0 # bumped when the overlay ends, see frames()
+        self.frame_ms = 33 # ~30 fps
+        self.now = utime.ticks_ms() # time of the frame being rendered
+        self.compositing = False
         
         self.sunrise_seconds = 300 # default 5 minutes i.e. 300 seconds
         self.sunset_seconds = 300 # default 5 minutes i.e. 300 seconds
-    
-        # make sure all pixels are off at startup
-        self.change_color((0,0,0,0))
+        
+        self.profiles = dict(NeoPixelLight.profiles)
+        self.profile_tables = {} # compiled profiles by name
+        self.load_profiles()
+        
+        # last checkpoint written to RTC memory and to flash
+        self.checkpointed = None
+        self.saved = None
+        self.checkpoint_start = (None, 0) # animation checkpointed, its start
+        # back to the state before a reset, or all pixels off
+        self.restore()
 
 
     def get_heartbeat_on(self):
@@ -43,17 +382,28 @@ class NeoPixelLight:
         self.heartbeat_on = False if self.heartbeat_on else True
         if self.heartbeat_on:
             self.led0 = 1
+            self.start(self.heartbeat_loop(), STATUS, 'heartbeat')
         elif not self.heartbeat_on:
             self.led0 = 0
+            self.cancel(STATUS)
     
-    def set_brightness(self, brightness):
-        r,g,b,w = self.current_color
-        r = int(r * brightness)
-        g = int(g * brightness)
-        b = int(b * brightness)
-        w = int(w * brightness)
+    def set_brightness(self, brightness, gamma=None):
+        '''
+        Set the global brightness (0 to 1) applied to every frame sent to
+        the strip, optionally switching gamma correction on/off. It takes
+        effect on the next frame, also during a running effect.
+        '''
+        self.brightness = min(1.0, max(0.0, brightness))
+        if gamma is not None:
+            self.gamma = gamma
         
-#         self.change_color((r,g,b,w))
+        level = int(self.brightness * 255 + .5)
+        if level == 255 and not self.gamma:
+            self.brightness_lut = None
+        else:
+            self.brightness_lut = brightness_table(level, self.gamma)
+        self.brightness_changed = True
+        self.commit()
     
     def toggle(self):
         '''
@@ -67,10 +417,10 @@ class NeoPixelLight:
         '''
         print('Turning light off')
         
+        self.cancel()
         color = (0,0,0,0)
-        for led in range(self.led0, self.np.n):
-            self.np[led] = color
-        self.np.write()
+        self.fill(color)
+        self.commit()
         
         # reset light_n flag and update current color
         self.light_on = False
@@ -82,23 +432,212 @@ class NeoPixelLight:
         '''
         print('Turning light on')
         
+        self.cancel()
         color = (255,255,255,255) if full else (255,255,255,0)
         
-        for led in range(self.led0, self.np.n):
-            self.np[led] = color
-        self.np.write()
+        self.fill(color)
+        self.commit()
         
         # reset light_on flag and update current color
         self.light_on = True
         self.current_color = color
 
+    def fill(self, color: tuple, start=None, end=None):
+        '''
+        Set the pixels from start (default led0) to end (default last led)
+        to the same color, working directly on the pixel buffer: the color
+        is packed once and then copied over the span with doubling slices
+        '''
+        bpp = self.np.bpp
+        start = self.led0 if start is None else start
+        end = self.np.n if end is None else end
+        if end <= start:
+            return
+        self.drawn = True
+        
+        buf = self.buf
+        lo = start * bpp
+        hi = end * bpp
+        order = self.np.ORDER
+        for i in range(bpp):
+            buf[lo + order[i]] = color[i]
+        
+        size = bpp
+        while lo + size < hi:
+            chunk = min(size, hi - lo - size)
+            buf[lo + size:lo + size + chunk] = buf[lo:lo + chunk]
+            size += chunk
+
+    def shade(self, color: tuple, distances: bytearray, reach: int, start=None):
+        '''
+        Write color to the pixels from start (default led0) on, each one
+        scaled by its weight min(255, max(0, reach - distance)), in a single
+        integer multiply-shift pass over the pixel buffer (see _shade)
+        '''
+        bpp = self.np.bpp
+        start = self.led0 if start is None else start
+        self.drawn = True
+        order = self.np.ORDER
+        # color components in the strip byte order
+        c = self.shade_color
+        for k in range(bpp):
+            c[order[k]] = color[k]
+        _shade(self.buf[start * bpp:], distances, c, reach)
+
+    def show(self):
+        '''
+        Send the frame buffer to the strip, scaled by the brightness table,
+        unless neither the frame nor the brightness changed since the last
+        frame sent: write() blocks with IRQs off, so redundant frames are
+        suppressed. Returns True if the strip was written.
+        '''
+        frame = self.frame
+        drawn = self.drawn
+        self.drawn = False
+        if self.last_frame is None:
+            self.last_frame = bytearray(frame)
+        elif not drawn and not self.brightness_changed:
+            # nothing drawn, e.g. an idle compositor tick: not a frame
+            return False
+        elif frame == self.last_frame and not self.brightness_changed:
+            self.frames_suppressed += 1
+            return False
+        else:
+            self.last_frame[:] = frame
+        self.brightness_changed = False
+        
+        lut = self.brightness_lut
+        out = self.np.buf
+        if lut is None:
+            out[:] = frame
+        else:
+            _scale(out, frame, lut)
+        self.np.write()
+        self.frames_written += 1
+        return True
+
+    def commit(self):
+        '''
+        Make a change to the pixel buffer visible: the compositor sends it
+        with the next frame, without it the strip is written right away
+        '''
+        if not self.compositing:
+            self.show()
+
+    def render(self, now=None):
+        '''
+        Render one frame: advance the effect of each layer (scene, status
+        led, overlay) and send the result with a single show()
+        '''
+        self.now = utime.ticks_ms() if now is None else now
+        for layer in (SCENE, STATUS, OVERLAY):
+            effect = self.layers[layer]
+            if effect is None:
+                if layer == SCENE and self.scene_color != self.current_color:
+                    self.fill(self.current_color)
+                    self.scene_color = self.current_color
+                continue
+            try:
+                next(effect)
+            except StopIteration:
+                self.end(layer, effect)
+        self.show()
+
+    async def compositor(self, fps=30):
+        '''
+        Long-lived task owning the strip: renders a frame at a fixed rate
+        '''
+        self.frame_ms = 1000 // fps
+        self.compositing = True
+        deadline = utime.ticks_ms()
+        try:
+            while True:
+                self.render()
+                
+                deadline = utime.ticks_add(deadline, self.frame_ms)
+                wait = utime.ticks_diff(deadline, utime.ticks_ms())
+                if wait < 0:
+                    # running late: restart the cadence instead of bursting
+                    deadline = utime.ticks_ms()
+                    wait = 0
+                await uasyncio.sleep_ms(wait)
+        finally:
+            self.compositing = False
+
+    def start(self, effect, layer=SCENE, name='effect', duration_ms=0, start_ms=None):
+        '''
+        Start an effect on a layer and register it, preempting the effect
+        running there: the switch happens on the next frame
+        '''
+        self.cancel(layer)
+        self.layers[layer] = effect
+        self.animations[layer] = Animation(name, effect, duration_ms, start_ms)
+
+    def end(self, layer: int, effect):
+        '''
+        Remove a finished effect from its layer and from the registry. The
+        pixels an overlay leaves are painted over: the status led is
+        blanked and the effects below draw their last frame again.
+        '''
+        if self.layers[layer] is effect:
+            self.layers[layer] = None
+            self.animations[layer] = None
+            self.scene_color = None
+            if layer == OVERLAY:
+                self.fill((0,0,0,0), 0, self.led0)
+                self.repaints += 1
+
+    def cancel(self, layer=SCENE):
+        '''
+        Stop the effect running on a layer, if any: the coroutine waiting
+        for it in play() returns within one frame
+        '''
+        effect = self.layers[layer]
+        if effect is None:
+            return
+        print(f'Cancelling {self.animations[layer].name}')
+        self.end(layer, effect)
+        effect.close()
+
+    def animation_state(self, layer=SCENE):
+        '''
+        Return (name, progress %, seconds left) of the effect running on a
+        layer, None if there is none
+        '''
+        animation = self.animations[layer]
+        if animation is None:
+            return None
+        now = utime.ticks_ms()
+        return animation.name, animation.progress(now), animation.eta(now)
+
+    async def play(self, effect, layer=SCENE, name='effect', duration_ms=0, start_ms=None):
+        '''
+        Run an effect on a layer, replacing the previous one, and wait
+        until it ends or is replaced in turn
+        '''
+        self.start(effect, layer, name, duration_ms, start_ms)
+        if not self.compositing:
+            # no compositor task: drive the effect from here
+            self.frame_ms = 33
+            while self.layers[layer] is effect:
+                self.now = utime.ticks_ms()
+                try:
+                    next(effect)
+                except StopIteration:
+                    self.end(layer, effect)
+                self.show()
+                await uasyncio.sleep_ms(self.frame_ms)
+            return
+        while self.layers[layer] is effect:
+            await uasyncio.sleep_ms(self.frame_ms)
+
     def change_color(self, color: tuple):
         '''
         Change to the specified color
         '''
-        for led in range(self.led0, self.np.n):
-            self.np[led] = color
-        self.np.write()
+        self.cancel()
+        self.fill(color)
+        self.commit()
         
         self.current_color = color
         if self.current_color != (0,0,0,0):
@@ -106,37 +645,93 @@ class NeoPixelLight:
         elif self.current_color == (0,0,0,0):
             self.light_on = False
 
-    async def fade_in(self, leds: list, color: tuple, delay: float, steps=500, start_color=(0,0,0,0)):
+    def frames(self, table: bytearray, steps: int, delay: float, start_ms=None, spans=None, shape=None):
         '''
-        Fade into a given color
+        Effect: play the (steps + 1) RGBW frames of a precomputed table over
+        delay seconds from start_ms (default now). Without spans it drives
+        the scene, i.e. led0 to the last led, and tracks current_color.
+        A shape (see SHAPES) spreads the scene colors over the strip.
+        '''
+        clock = FrameScheduler(delay * 1000, steps, self.now if start_ms is None else start_ms, self.now)
+        if shape is not None:
+            origin, reach_start = SHAPES[shape]
+        
+        frame = None
+        reach = None
+        last = None # last step drawn
+        repaints = self.repaints
+        while True:
+            step = clock.due(self.now)
+            if step is not None and step < 0:
+                break
+            if repaints != self.repaints:
+                # the overlay drew over this effect: draw the last step again
+                repaints = self.repaints
+                frame = reach = None
+                if step is None:
+                    step = last
+            if step is None:
+                yield
+                continue
+            last = step
+            i = step * 4
+            color_step = (table[i], table[i + 1], table[i + 2], table[i + 3])
+            if shape is not None:
+                # the light reaches the whole strip at the end of the effect
+                reach_step = reach_start + (510 - reach_start) * step // steps
+                if color_step != frame or reach_step != reach:
+                    frame = color_step
+                    reach = reach_step
+                    self.current_color = frame
+                    self.light_on = frame != (0,0,0,0)
+                    self.shade(frame, distance_table(origin, self.np.n - self.led0), reach)
+            elif color_step != frame:
+                # a step with the same quantized color has nothing to draw
+                frame = color_step
+                if spans is None:
+                    self.current_color = frame
+                    self.light_on = frame != (0,0,0,0)
+                    self.fill(frame)
+                else:
+                    for lo, hi in spans:
+                        self.fill(frame, lo, hi)
+            yield
+        
+        elapsed = utime.ticks_diff(self.now, clock.start)
+        print(f'End of animation into color {frame} - elapsed time {elapsed/1000} seconds ({clock.report()})')
+        self.fade_stats = (clock.rendered, clock.dropped, clock.max_late)
+        if spans is None:
+            self.light_on = frame != (0,0,0,0)
+
+    def fade(self, color: tuple, delay: float, steps=500, start_color=(0,0,0,0), start_ms=None, spans=None):
+        '''
+        Effect: fade into a given color, in at most one step per frame the
+        delay leaves room for
         '''
         print(f'Start fade from {start_color} to {color}')
-        start = utime.time()
-        # get the step size for each color component
-        sr, sg, sb, sw = start_color
-        er, eg, eb, ew = color
-        
-        r_step = (er - sr) / steps
-        g_step = (eg - sg) / steps
-        b_step = (eb - sb) / steps
-        w_step = (ew - sw) / steps
-        
-        print(f'Fade-in delay: {delay} seconds')
-        for step in range(steps + 1):
-            for led in leds:
-                self.np[led] = (int(sr + step * r_step), int(sg + step * g_step), int(sb + step * b_step), int(sw + step * w_step))
-            self.np.write()
-            self.current_color = (int(sr + step * r_step), int(sg + step * g_step), int(sb + step * b_step), int(sw + step * w_step))
-            await uasyncio.sleep(delay/steps)
-        end = utime.time()
-        print(f'End fade into color {color} - elapsed time {end-start} seconds')
-        self.current_color = color
-        if self.current_color != (0,0,0,0):
-            self.light_on = True
-        elif self.current_color == (0,0,0,0):
-            self.light_on = False
+        # a short fade, e.g. a heartbeat, cannot show more steps than frames
+        steps = max(1, min(steps, int(delay * 1000) // self.frame_ms))
+        # precomputed (and possibly cached) frames of the fade
+        table = fade_table(start_color, color, steps)
+        return self.frames(table, steps, delay, start_ms, spans)
+
+    async def fade_in(self, leds: list, color: tuple, delay: float, steps=500, start_color=(0,0,0,0), start_ms=None):
+        '''
+        Fade the given leds into a given color
+        '''
+        if leds == list(range(self.led0, self.np.n)):
+            spans = None
+        elif leds and len(leds) == leds[-1] - leds[0] + 1:
+            # contiguous leds are filled as one span, otherwise one by one
+            spans = ((leds[0], leds[-1] + 1),)
+        else:
+            spans = tuple((led, led + 1) for led in leds)
+        await self.play(self.fade(color, delay, steps, start_color, start_ms, spans), name='fade', duration_ms=delay * 1000, start_ms=start_ms)
     
-    async def heartbeat(self, leds: list, color: tuple, delay=.5, brightness=.3):
+    def heartbeat(self, color: tuple, delay=.5, brightness=.3):
+        '''
+        Effect: a single beat of the status led
+        '''
         # brightness is a number between 0 and 1
         delay = delay * 0.33 * 0.5
         r,g,b,w = color
@@ -144,44 +739,191 @@ class NeoPixelLight:
         g = int(g * brightness)
         b = int(b * brightness)
         w = int(w * brightness)
-        uasyncio.run(self.fade_in(leds=leds, start_color=(0,0,0,0), color=(r,g,b,w), delay=delay))
-        uasyncio.run(self.fade_in(leds=leds, start_color=(r,g,b,w), color=(0,0,0,0), delay=delay))
+        yield from self.fade(start_color=(0,0,0,0), color=(r,g,b,w), delay=delay, spans=((0, 1),))
+        yield from self.fade(start_color=(r,g,b,w), color=(0,0,0,0), delay=delay, spans=((0, 1),))
 
-    async def start_heartbeat(self, brightness=.2, delay=60):
+    def heartbeat_loop(self, brightness=.2, delay=60):
+        '''
+        Effect: beat the status led every delay seconds while the heartbeat
+        is on
+        '''
         while self.heartbeat_on is True:
-            uasyncio.create_task(self.heartbeat(leds=[0], color=NeoPixelLight.presets['red'], brightness=brightness))
-            await uasyncio.sleep(delay)
-
-    async def ambient(self, delay: float, sunset=False):
-        leds = [led for led in range(self.led0, self.np.n)]
-        color = (36,24,4,0) if not sunset else (0,0,0,0)
-        start_color = (0,0,0,0) if not sunset else (36,24,4,0)
-        uasyncio.run(self.fade_in(leds=leds, color=color, delay=delay, start_color=start_color))
-    
-    async def golden_hour(self, delay: float, sunset=False):
-        leds = [led for led in range(self.led0, self.np.n)]
-        color = (255,64,0,0) if not sunset else (12,12,12,0)
-        start_color = (12,12,12,0) if not sunset else (255,64,0,0)
-        uasyncio.run(self.fade_in(leds=leds, color=color, delay=delay, start_color=start_color))
-    
-    async def full_sun(self, delay: float, sunset=False):
-        leds = [led for led in range(self.led0, self.np.n)]
-        color = (255,153,51,0) if not sunset else (255,64,0,0)
-        start_color = (255,64,0,0) if not sunset else (255,153,51,0)
-        uasyncio.run(self.fade_in(leds=leds, color=color, delay=delay, start_color=start_color))
-    
-    async def sunrise(self, delay: float):
-        ambient_delay = int(delay * .1)
-        golden_hour_delay = int(delay * .8)
-        full_sun_delay = int(delay * .2)
-        await self.ambient(ambient_delay)
-        await self.golden_hour(golden_hour_delay)
-        await self.full_sun(full_sun_delay)
-    
-    async def sunset(self, delay: float):
-        ambient_delay = int(delay * .1)
-        golden_hour_delay = int(delay * .8)
-        full_sun_delay = int(delay * .2)
-        await self.full_sun(full_sun_delay, sunset=True)
-        await self.golden_hour(golden_hour_delay, sunset=True)
-        await self.ambient(ambient_delay, sunset=True)
+            start = self.now
+            yield from self.heartbeat(color=NeoPixelLight.presets['red'], brightness=brightness)
+            while utime.ticks_diff(self.now, start) < delay * 1000:
+                yield
+
+    async def start_heartbeat(self, brightness=.2, delay=60):
+        if self.heartbeat_on:
+            await self.play(self.heartbeat_loop(brightness, delay), STATUS, 'heartbeat')
+
+    def flash(self, color: tuple, times=3, delay=.5):
+        '''
+        Effect: blink the whole strip on top of the other layers
+        '''
+        for _ in range(times):
+            for c in (color, (0,0,0,0)):
+                start = self.now
+                self.fill(c, 0)
+                while utime.ticks_diff(self.now, start) < delay * 500:
+                    yield
+                    self.fill(c, 0)
+
+    def load_profiles(self, path='profiles.json'):
+        '''
+        Load keyframe profiles from a json file of the form
+        {"name": {"easing": "ease_in", "shape": "glow_center", "stops": [[0, [0,0,0,0]], [1, [255,153,51,0]]]}}
+        where easing and shape are optional
+        '''
+        try:
+            with open(path, 'r') as f:
+                profiles = ujson.load(f)
+        except (OSError, ValueError) as e:
+            print(f'Cannot load profiles: {e}')
+            return
+        for name, profile in profiles.items():
+            # make sure the profile compiles before accepting it
+            try:
+                compile_profile(profile['stops'], profile.get('easing', 'linear'), steps=1)
+                if profile.get('shape') is not None:
+                    SHAPES[profile['shape']]
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f'Invalid profile {name}: {e}')
+                continue
+            self.profiles[name] = profile
+            self.profile_tables.pop(name, None)
+    
+    def profile_table(self, name: str):
+        '''
+        Return the compiled frames of a profile, compiling it on first use
+        '''
+        table = self.profile_tables.get(name)
+        if table is None:
+            profile = self.profiles[name]
+            table = compile_profile(profile['stops'], profile.get('easing', 'linear'))
+            self.profile_tables[name] = table
+        return table
+    
+    def profile_effect(self, name: str, delay: float, start_ms=None):
+        '''
+        Effect: play a keyframe profile over delay seconds
+        '''
+        print(f'Start profile {name} - {delay} seconds')
+        shape = self.profiles[name].get('shape')
+        return self.frames(self.profile_table(name), PROFILE_STEPS, delay, start_ms, shape=shape)
+    
+    async def play_profile(self, name: str, delay: float, elapsed=0):
+        '''
+        Play a keyframe profile over delay seconds, starting elapsed seconds
+        into it (e.g. to resume it)
+        '''
+        start_ms = utime.ticks_add(utime.ticks_ms(), -int(elapsed * 1000))
+        await self.play(self.profile_effect(name, delay, start_ms), name=name, duration_ms=delay * 1000, start_ms=start_ms)
+    
+    def checkpoint(self):
+        '''
+        Save the light state (color, brightness, running profile) if it
+        changed: to RTC memory, which survives resets but not power cuts,
+        and to flash, only when it changes for good, i.e. not at every step
+        of a profile
+        '''
+        animation = self.animations[SCENE]
+        name, start, duration = b'', 0, 0
+        if animation is not None and animation.name in self.profiles and animation.duration > 0:
+            name = animation.name.encode()
+            if self.checkpoint_start[0] is not animation:
+                # computed once: rounding must not move it between checkpoints
+                self.checkpoint_start = (animation, utime.time() - animation.elapsed(utime.ticks_ms()) // 1000)
+            start = self.checkpoint_start[1]
+            duration = animation.duration
+        flags = CHECKPOINT_GAMMA if self.gamma else 0
+        data = ustruct.pack(CHECKPOINT_FORMAT, CHECKPOINT_MAGIC, *self.current_color,
+                            int(self.brightness * 255 + .5), flags, start, duration, name)
+        if data == self.checkpointed:
+            return False
+        self.checkpointed = data
+        stable = data[:2] + data[6:] if name else data
+        data += ustruct.pack('<I', ubinascii.crc32(data))
+        RTC().memory(data)
+        
+        if stable != self.saved:
+            try:
+                with open(CHECKPOINT_FILE, 'wb') as f:
+                    f.write(data)
+                self.saved = stable
+            except OSError as e:
+                print(f'Cannot save light checkpoint: {e}')
+        return True
+    
+    def load_checkpoint(self):
+        '''
+        Return the fields of the last checkpoint, from RTC memory if it
+        survived the reset, else from flash, None if there is none
+        '''
+        size = ustruct.calcsize(CHECKPOINT_FORMAT)
+        state = None
+        for source in ('rtc', 'flash'):
+            if source == 'rtc':
+                data = RTC().memory()
+            else:
+                try:
+                    with open(CHECKPOINT_FILE, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    continue
+            if len(data) != size + 4 or data[:2] != CHECKPOINT_MAGIC:
+                continue
+            if ustruct.unpack('<I', data[size:])[0] != ubinascii.crc32(data[:size]):
+                continue
+            data = data[:size]
+            fields = ustruct.unpack(CHECKPOINT_FORMAT, data)[1:]
+            if source == 'flash':
+                # no need to write it again until it changes
+                self.saved = data[:2] + data[6:] if fields[-1].rstrip(b'\0') else data
+            if state is None:
+                state = fields
+        return state
+    
+    def restore(self):
+        '''
+        Bring the strip back to the last checkpoint (all pixels off if there
+        is none): color and brightness, and the running profile at the
+        point it has reached if the clock survived the reset
+        '''
+        state = self.load_checkpoint()
+        if state is None:
+            self.change_color((0,0,0,0))
+            return False
+        r, g, b, w, level, flags, start, duration, name = state
+        color = (r, g, b, w)
+        name = name.rstrip(b'\0').decode()
+        elapsed = (utime.time() - start) * 1000
+        resume = name in self.profiles and 0 <= elapsed < duration
+        if name in self.profiles and elapsed >= duration:
+            # the profile ended in the meantime: show its last frame
+            table = self.profile_table(name)
+            i = PROFILE_STEPS * 4
+            color = (table[i], table[i + 1], table[i + 2], table[i + 3])
+        print(f'Restoring light {color}, brightness {level}' + (f', {name} at {elapsed // 1000} s' if resume else ''))
+        
+        self.fill(color)
+        self.current_color = color
+        self.light_on = color != (0,0,0,0)
+        self.set_brightness(level / 255, flags & CHECKPOINT_GAMMA != 0)
+        if resume:
+            start_ms = utime.ticks_add(utime.ticks_ms(), -elapsed)
+            self.start(self.profile_effect(name, duration / 1000, start_ms), name=name, duration_ms=duration, start_ms=start_ms)
+            self.render()
+        self.checkpoint()
+        return True
+    
+    async def checkpoint_loop(self, interval=10):
+        while True:
+            await uasyncio.sleep(interval)
+            self.checkpoint()
+    
+    async def sunrise(self, delay: float, profile='sunrise', elapsed=0):
+        await self.play_profile(profile, delay, elapsed)
+    
+    async def sunset(self, delay: float, profile='sunset', elapsed=0):
+        await self.play_profile(profile, delay, elapsed)
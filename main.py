@@ -1,17 +1,12 @@
 import gc
-gc.enable()
-gc.collect()
-
 import uasyncio
 import ujson
 
-from light import NeoPixelLight
 from sunrise import NeoPixelAlarm
 from mqtt import NeoPixelMQTT
+from startup import STARTUP
 
-
-STRIP_PIN = 16
-NUM_LEDS = 30
+STARTUP.mark('imports')
 
 dht_config = {
     'dht_pin': 13,
@@ -33,26 +28,33 @@ except OSError as e:
 
 
 if __name__ == '__main__':
-    neo = NeoPixelLight(STRIP_PIN, NUM_LEDS)
+    # neo, the light, is created and restored by boot.py
     neo_mqtt = NeoPixelMQTT(neo,
                             dht_config=dht_config,
                             btn_config=btn_config,
                             mqtt_config=mqtt_config,
                             wifi_config=wifi_config)
+    STARTUP.mark('init')
     
     if start:
         gc.collect()
         ## alarm
-        uasyncio.create_task(neo_mqtt.neo_alarm.call_update_time(3600))
-        uasyncio.create_task(neo_mqtt.neo_alarm.check_for_alarm(0.5))
+        uasyncio.create_task(neo_mqtt.neo_alarm.call_update_time())
+        uasyncio.create_task(neo_mqtt.neo_alarm.check_for_alarm())
+        uasyncio.create_task(neo_mqtt.neo_alarm.settings.run())
+        uasyncio.create_task(neo_mqtt.neo_alarm.state.run())
         
         ## light
+        uasyncio.create_task(neo_mqtt.neo.compositor())
         uasyncio.create_task(neo_mqtt.neo.start_heartbeat())
+        uasyncio.create_task(neo_mqtt.neo.checkpoint_loop(10))
         
         ## mqtt
         uasyncio.create_task(neo_mqtt.mqtt_heartbeat(60))
         uasyncio.create_task(neo_mqtt.send_dht(900))
+        uasyncio.create_task(neo_mqtt.forward_telemetry())
         uasyncio.create_task(neo_mqtt.send_updates(3600))
+        uasyncio.create_task(neo_mqtt.publisher(250))
         
         try:
             gc.collect()
@@ -1,22 +1,47 @@
-import gc
-gc.enable()
-gc.collect()
-
-import network
 import utime
 import uasyncio
-import _thread
-import dht
 from machine import Pin
 from mqtt_as import MQTTClient, config
-from sunrise import NeoPixelAlarm
+from sunrise import NeoPixelAlarm, day_names
+from startup import STARTUP
+from sensor import Sampler, SCALE
+from telemetry import Telemetry
 import ujson
 
 
+class State:
+    '''
+    Values of the state fields as last published, to publish only the
+    fields that changed since
+    '''
+    
+    def __init__(self):
+        self.published = {}
+    
+    def changes(self, values: dict):
+        '''
+        Return the fields whose value changed and record them as published
+        '''
+        changed = {}
+        for field, value in values.items():
+            if self.published.get(field) != value:
+                changed[field] = value
+                self.published[field] = value
+        return changed
+    
+    def clear(self):
+        '''
+        Forget what was published, e.g. after a reconnection, so that the
+        next publish sends every field
+        '''
+        self.published = {}
+
+
 class NeoPixelMQTT:
     topics = ['toggle_light', 'set_brightness', 'toggle_heartbeat', 'set_alarm_time',
-              'set_rgbw', 'set_utc_offset', 'set_dst_offset', 'set_alarm_hour',
-              'set_alarm_minute', 'set_alarm_delay', 'toggle_alarm', 'publish_updates']
+              'set_rgbw', 'set_timezone', 'set_utc_offset', 'set_dst_offset', 'set_alarm_hour',
+              'set_alarm_minute', 'set_alarm_days', 'set_alarm_delay', 'toggle_alarm', 'toggle_daily_alarm', 'set_profile', 'snooze', 'dismiss', 'add_alarm', 'remove_alarm', 'publish_updates',
+              'get_dht_history']
     
     
     def __init__(self, neopixel_obj, dht_config: dict, btn_config: dict, mqtt_config: dict, wifi_config: dict):
@@ -33,11 +58,25 @@ class NeoPixelMQTT:
         config['ssl'] = mqtt_config['ssl']
         config['ssl_params'] = mqtt_config['ssl_params']
         config['clean'] = mqtt_config['clean']
+        config['pub_window'] = 16 # a whole state refresh in flight
         
         config['ssid'] = wifi_config['ssid']
         config['wifi_pw'] = wifi_config['wifi_pw']
         
         self.topic_prefix = mqtt_config['topic_prefix']
+        # 'topics': one topic per changed field, 'document': the whole state
+        # as a json document on prefix/state whenever a field changed
+        self.state_mode = mqtt_config.get('state_mode', 'topics')
+        self.state = State()
+        # publish requests waiting for the publisher task, merged into one
+        self.publish_due = uasyncio.Event()
+        self.full_publish = False
+        self.history_due = False
+        self.sync_task = None # publish_updates request being served
+        # handler of each topic, keyed by the full topic as received
+        self.handlers = {}
+        for topic in NeoPixelMQTT.topics:
+            self.handlers[f'{self.topic_prefix}/{topic}'.encode()] = getattr(self, f'on_{topic}')
         
         
         MQTTClient.DEBUG = True
@@ -45,45 +84,120 @@ class NeoPixelMQTT:
         
         self.dht_config = dht_config
         self.btn_config = btn_config
-        self.dht = None
+        self.dht = None # initialized on first use by send_dht()
+        self.sampler = Sampler()
+        self.telemetry = Telemetry(('temp', 'hum'))
         self.btn = None
-        self.dht_init()
         self.btn_init()
         
     
-    async def publish_updates(self):
+    def state_values(self):
+        '''
+        Current value of each state field, formatted from a single time
+        snapshot
+        '''
+        now = utime.localtime()
+        state = self.neo.animation_state()
+        alarm = self.neo_alarm
+        return {
+            'light_on': f'{self.neo.light_on}',
+            'alarm_on': f'{alarm.alarm_on}',
+            'daily_alarm_on': f'{alarm.daily_on}',
+            'animation': f'{state[0]} {state[1]}% ({state[2]} s left)' if state is not None else 'none',
+            'current_rgbw': f'{self.neo.current_color}',
+            'brightness': f'{self.neo.brightness}',
+            'alarm_delay': f'{alarm.alarm_delay/60}',
+            'profile': f'{alarm.profile}',
+            'alarm_time': f'{alarm.alarm_hour:02d}:{alarm.alarm_minute:02d}',
+            'alarm_days': ','.join(day_names(alarm.alarm_days)),
+            'alarms': alarm.alarms_config(),
+            'next_alarm': self.date_time(alarm.next_alarm),
+            'current_time': f'{now[3]:02d}:{now[4]:02d}',
+            'current_date': f'{now[2]:02d}/{now[1]:02d}/{now[0]}',
+            'clock_drift': f'{alarm.drift.rate:.1f} ppm ({alarm.drift.offset} ms at last sync)',
+            'next_sync': self.date_time(alarm.next_sync),
+            'timezone': f'{alarm.tz.spec if alarm.tz else "fixed"}: {alarm.utc_offset/3600} UTC (+ {alarm.dst_offset/3600} DST)'
+            }
+    
+    async def publish_updates(self, full=False):
+        '''
+        Publish the state fields that changed since the last publish, all of
+        them if full
+        '''
         try:
-            await self.client.publish(f'{self.topic_prefix}/light_on', f'{self.neo.light_on}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/alarm_on', f'{self.neo_alarm.alarm_on}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/current_rgbw', f'{self.neo.current_color}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/brightness', f'{self.neo.brightness}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/alarm_delay', f'{self.neo_alarm.alarm_delay/60}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/alarm_time', f'{self.neo_alarm.alarm_hour:02d}:{self.neo_alarm.alarm_minute:02d}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/current_time', f'{utime.localtime()[3]:02d}:{utime.localtime()[4]:02d}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/current_date', f'{utime.localtime()[2]:02d}/{utime.localtime()[1]:02d}/{utime.localtime()[0]}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/timezone', f'{self.neo_alarm.utc_offset/3600} UTC (+ {self.neo_alarm.dst_offset/3600} DST)', qos=1)
+            if full:
+                self.state.clear()
+            changes = self.state.changes(self.state_values())
+            if not changes:
+                return
+            if self.state_mode == 'document':
+                msgs = ((f'{self.topic_prefix}/state', ujson.dumps(self.state.published)),)
+            else:
+                msgs = tuple((f'{self.topic_prefix}/{field}', value if isinstance(value, str) else ujson.dumps(value))
+                             for field, value in changes.items())
+            # sent back-to-back, the acks are awaited together
+            await self.client.publish_many(msgs, qos=1)
         except OSError as e:
             await self.client.publish(f'{self.topic_prefix}/logs', f'{e}', qos=1)
     
     
+    def request_publish(self, full=False):
+        '''
+        Ask the publisher task for a state publish, all fields if full: the
+        requests made in the meantime are merged into the same publish
+        '''
+        self.full_publish = self.full_publish or full
+        self.publish_due.set()
+    
+    async def publisher(self, debounce_ms=250):
+        '''
+        Long-lived task publishing the state debounce_ms after a request, so
+        a burst of commands (e.g. a slider) costs a single publish and at
+        most one is ever pending, whatever the rate of the commands. A
+        requested DHT history goes out after it.
+        '''
+        while True:
+            await self.publish_due.wait()
+            await uasyncio.sleep_ms(debounce_ms)
+            self.publish_due.clear()
+            full = self.full_publish
+            self.full_publish = False
+            await self.publish_updates(full)
+            if self.history_due:
+                self.history_due = False
+                await self.client.publish(f'{self.topic_prefix}/dht_history', self.dht_history(), qos=1)
+    
+    def date_time(self, t):
+        '''
+        dd/mm/yyyy HH:MM of a local time, 'None' if None
+        '''
+        if t is None:
+            return 'None'
+        t = utime.localtime(t)
+        return f'{t[2]:02d}/{t[1]:02d}/{t[0]} {t[3]:02d}:{t[4]:02d}'
+    
     def save_to_config(self):
         res = {
             "sunrise_delay": self.neo_alarm.alarm_delay,
             "utc_offset": self.neo_alarm.utc_offset,
             "dst_offset": self.neo_alarm.dst_offset,
+            "timezone": self.neo_alarm.tz.spec if self.neo_alarm.tz else None,
             "alarm_hour": self.neo_alarm.alarm_hour,
             "alarm_minute": self.neo_alarm.alarm_minute,
-            "alarm_on": 1 if self.neo_alarm.alarm_on else 0
+            "alarm_on": 1 if self.neo_alarm.alarm_on else 0,
+            "daily_alarm_on": 1 if self.neo_alarm.daily_on else 0,
+            "alarm_days": day_names(self.neo_alarm.alarm_days),
+            "sunrise_profile": self.neo_alarm.profile,
+            "sunrise_lead": 1 if self.neo_alarm.lead else 0,
+            "time_error": self.neo_alarm.time_error,
+            "alarms": self.neo_alarm.alarms_config()
         }
-        
-        try:
-            with open('config.json', 'w') as f:
-                ujson.dump(res, f)
-        except OSError as e:
-            print(f'Error saving configuration: {e}')
+        # written behind, once a burst of settings messages is over
+        self.neo_alarm.settings.update(res)
         
     def dht_init(self):
         print('Initializing DHT sensor...')
+        import dht
         
         gnd = Pin(self.dht_config['dht_gnd'], Pin.OUT)
         vcc = Pin(self.dht_config['dht_vcc'], Pin.OUT)
@@ -100,11 +214,11 @@ class NeoPixelMQTT:
        
     async def send_updates(self, delay:float):
         '''
-        Call the publish_updates function at a given interval to periodically
-        publish updates to all topics
+        Request a full publish at a given interval to periodically publish
+        updates to all topics
         '''
         while True:
-            uasyncio.create_task(self.publish_updates())
+            self.request_publish(full=True)
             await uasyncio.sleep(delay)
     
     async def mqtt_connect(self):
@@ -112,86 +226,177 @@ class NeoPixelMQTT:
         Main function to start a connection and events loop
         '''
         await self.client.connect()
+        STARTUP.mark('mqtt')
+        await self.client.publish(f'{self.topic_prefix}/startup', STARTUP.report(), qos=1)
         for coroutine in (self.up, self.messages):
             uasyncio.create_task(coroutine())
+        # keep the event loop running without spinning the CPU
         while True:
-            await uasyncio.sleep(0)
+            await uasyncio.sleep(1)
    
     async def messages(self):
         '''
         Handle incoming messages
         '''
         async for topic, msg, retained in self.client.queue:
-            topic = topic.decode('utf-8')
-            msg = msg.decode('utf-8')
-            
-            print(f'topic: {topic} -- message: {msg}')
-            
-            if topic == f'{self.topic_prefix}/toggle_light':
-                self.neo.toggle()
-                uasyncio.create_task(self.publish_updates())
-            
-            elif topic == f'{self.topic_prefix}/set_brightness':
-                self.neo.set_brightness(float(msg))
-                uasyncio.create_task(self.publish_updates())
-            
-            elif topic == f'{self.topic_prefix}/toggle_heartbeat':
-                self.neo.heartbeat_on = False if self.neo.heartbeat_on else True
-            
-            elif topic == f'{self.topic_prefix}/set_rgbw':
-                if '#' in msg:
-                    hex = msg.lstrip('#')
-                    r, g, b = tuple(int(hex[i:i+2], 16) for i in (0, 2, 4))
-                else:
-                    msg = msg.split('rgb')[1]
-                    msg = msg.lstrip('(').strip(')')
-                    msg = msg.split(',')
-                    r = int(msg[0])
-                    g = int(msg[1])
-                    b = int(msg[2])
-                color = (r,g,b,0)
-                self.neo.change_color(color)
-                uasyncio.create_task(self.publish_updates())
-            
-            elif topic == f'{self.topic_prefix}/set_utc_offset':
-                self.neo_alarm.utc_offset = int(msg) * 3600
-                uasyncio.create_task(self.publish_updates())
-                self.save_to_config()
-            
-            elif topic == f'{self.topic_prefix}/set_dst_offset':
-                self.neo_alarm.dst_offset = int(msg) * 3600
-                uasyncio.create_task(self.publish_updates())
-                self.save_to_config()
-            
-            elif topic == f'{self.topic_prefix}/set_alarm_time':
-                self.neo_alarm.alarm_hour = int(msg.split(':')[0])
-                self.neo_alarm.alarm_minute = int(msg.split(':')[1])
-                uasyncio.create_task(self.publish_updates())
-                self.save_to_config()
-                
-            elif topic == f'{self.topic_prefix}/set_alarm_hour':
-                self.neo_alarm.alarm_hour = int(msg)
-                uasyncio.create_task(self.publish_updates())
-                self.save_to_config()
-                
-            elif topic == f'{self.topic_prefix}/set_alarm_minute':
-                self.neo_alarm.alarm_minute = int(msg)
-                uasyncio.create_task(self.publish_updates())
-                self.save_to_config()
-            
-            elif topic == f'{self.topic_prefix}/set_alarm_delay':
-                self.neo_alarm.alarm_delay = int(msg) * 60
-                uasyncio.create_task(self.publish_updates())
-                self.save_to_config()
-            
-            elif topic == f'{self.topic_prefix}/toggle_alarm':
-                self.neo_alarm.alarm_on = False if self.neo_alarm.alarm_on else True
-                uasyncio.create_task(self.publish_updates())
-                self.save_to_config()
-            
-            elif topic == f'{self.topic_prefix}/publish_updates':
-                self.neo_alarm.update_time()
-                uasyncio.create_task(self.publish_updates())
+            self.dispatch(topic, msg)
+    
+    def dispatch(self, topic, msg):
+        '''
+        Call the handler of a message, looked up with the raw topic: the
+        messages the lamp publishes itself, which come back through the
+        prefix/# subscription, are dropped without decoding anything
+        '''
+        handler = self.handlers.get(bytes(topic))
+        if handler is None:
+            return False
+        msg = msg.decode('utf-8')
+        print(f'topic: {topic.decode("utf-8")} -- message: {msg}')
+        try:
+            handler(msg)
+        except (IndexError, ValueError) as e:
+            print(f'Invalid message {msg}: {e}')
+        return True
+    
+    def on_toggle_light(self, msg):
+        self.neo_alarm.dismiss()
+        self.neo.toggle()
+        self.request_publish()
+    
+    def on_set_brightness(self, msg):
+        self.neo.set_brightness(float(msg))
+        self.request_publish()
+    
+    def on_toggle_heartbeat(self, msg):
+        self.neo.toggle_heartbeat()
+    
+    def on_set_rgbw(self, msg):
+        if '#' in msg:
+            hex = msg.lstrip('#')
+            r, g, b = tuple(int(hex[i:i+2], 16) for i in (0, 2, 4))
+        else:
+            msg = msg.split('rgb')[1]
+            msg = msg.lstrip('(').strip(')')
+            msg = msg.split(',')
+            r = int(msg[0])
+            g = int(msg[1])
+            b = int(msg[2])
+        color = (r,g,b,0)
+        self.neo_alarm.dismiss()
+        self.neo.change_color(color)
+        self.request_publish()
+    
+    def on_set_timezone(self, msg):
+        try:
+            self.neo_alarm.set_timezone(msg)
+            self.save_to_config()
+        except (ValueError, IndexError) as e:
+            print(f'Invalid timezone {msg}: {e}')
+        self.request_publish()
+    
+    def on_set_utc_offset(self, msg):
+        self.neo_alarm.set_offsets(int(msg) * 3600, self.neo_alarm.dst_offset)
+        self.request_publish()
+        self.save_to_config()
+        self.neo_alarm.reschedule()
+    
+    def on_set_dst_offset(self, msg):
+        self.neo_alarm.set_offsets(self.neo_alarm.utc_offset, int(msg) * 3600)
+        self.request_publish()
+        self.save_to_config()
+        self.neo_alarm.reschedule()
+    
+    def on_set_alarm_time(self, msg):
+        hour, minute = msg.split(':')
+        self.neo_alarm.set_alarm_time(int(hour), int(minute))
+        self.request_publish()
+        self.save_to_config()
+    
+    def on_set_alarm_hour(self, msg):
+        self.neo_alarm.set_alarm_time(hour=int(msg))
+        self.request_publish()
+        self.save_to_config()
+    
+    def on_set_alarm_minute(self, msg):
+        self.neo_alarm.set_alarm_time(minute=int(msg))
+        self.request_publish()
+        self.save_to_config()
+    
+    def on_set_alarm_days(self, msg):
+        self.neo_alarm.set_alarm_days(msg)
+        self.request_publish()
+        self.save_to_config()
+    
+    def on_set_alarm_delay(self, msg):
+        self.neo_alarm.alarm_delay = int(msg) * 60
+        self.request_publish()
+        self.save_to_config()
+        self.neo_alarm.reschedule()
+    
+    def on_toggle_alarm(self, msg):
+        self.neo_alarm.alarm_on = False if self.neo_alarm.alarm_on else True
+        self.request_publish()
+        self.save_to_config()
+        self.neo_alarm.reschedule()
+    
+    def on_toggle_daily_alarm(self, msg):
+        self.neo_alarm.daily_on = False if self.neo_alarm.daily_on else True
+        self.request_publish()
+        self.save_to_config()
+        self.neo_alarm.reschedule()
+    
+    def on_set_profile(self, msg):
+        # reload the profiles file so tuned profiles are picked up
+        self.neo.load_profiles()
+        if msg in self.neo.profiles:
+            self.neo_alarm.profile = msg
+            self.neo.profile_table(msg)
+            self.save_to_config()
+            # the daily alarm in the schedule carries its profile
+            self.neo_alarm.reschedule()
+        else:
+            print(f'Unknown profile: {msg}')
+        self.request_publish()
+    
+    def on_snooze(self, msg):
+        self.neo_alarm.snooze(int(msg) if msg.isdigit() else None)
+        self.request_publish()
+    
+    def on_dismiss(self, msg):
+        self.neo_alarm.dismiss()
+        self.request_publish()
+    
+    def on_add_alarm(self, msg):
+        try:
+            alarm = self.neo_alarm.add_alarm(ujson.loads(msg))
+            print(f'Added alarm {alarm.config()}')
+            self.save_to_config()
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            print(f'Invalid alarm {msg}: {e}')
+        self.request_publish()
+    
+    def on_remove_alarm(self, msg):
+        if msg.isdigit() and self.neo_alarm.remove_alarm(int(msg)):
+            self.save_to_config()
+        else:
+            print(f'Unknown alarm: {msg}')
+        self.request_publish()
+    
+    def on_publish_updates(self, msg):
+        # the requests made while one is served are answered by it
+        if self.sync_task is None:
+            self.sync_task = uasyncio.create_task(self.update_and_publish())
+    
+    def on_get_dht_history(self, msg):
+        self.history_due = True
+        self.request_publish()
+    
+    async def update_and_publish(self):
+        try:
+            await self.neo_alarm.update_time()
+        finally:
+            self.sync_task = None
+        self.request_publish(full=True)
     
     async def up(self):
         '''
@@ -201,6 +406,8 @@ class NeoPixelMQTT:
             await self.client.up.wait()
             self.client.up.clear()
             await self.client.subscribe(f'{self.topic_prefix}/#', qos=1)
+            # the subscribers may have missed anything published while down
+            self.request_publish(full=True)
 #             for topic in NeoPixelMQTT.topics:
 #                 await self.client.subscribe(f'{self.topic_prefix}/{topic}', qos=1)
 
@@ -210,15 +417,73 @@ class NeoPixelMQTT:
         Publsh mqtt heartbeat
         '''
         while True:
-            await self.client.publish(f'{self.topic_prefix}/heartbeat', 'beat', qos=1)
+            # a beat queued while down would tell nothing on arrival
+            if self.client.isconnected():
+                await self.client.publish(f'{self.topic_prefix}/heartbeat', 'beat', qos=1)
             await uasyncio.sleep(delay)
     
-    async def send_dht(self, delay: float):
+    async def send_dht(self, delay: float, period=30):
         '''
-        Periodically publish DHT updates
+        Sample the DHT sensor every period seconds and publish temperature
+        and humidity (median filtered) when they move past their deadband,
+        or at least every delay seconds
         '''
+        if self.dht is None:
+            self.dht_init()
+            # give the sensor time to power up
+            await uasyncio.sleep(2)
+        self.sampler.max_interval = delay
         while True:
-            self.dht.measure()
-            await self.client.publish(f'{self.topic_prefix}/temp', f'{self.dht.temperature()}', qos=1)
-            await self.client.publish(f'{self.topic_prefix}/hum', f'{self.dht.humidity()}', qos=1)
-            await uasyncio.sleep(delay)
+            try:
+                self.dht.measure()
+                self.sampler.add(self.dht.temperature(), self.dht.humidity())
+            except OSError as e:
+                # a sensor that does not answer, try again on the next sample
+                self.sampler.errors += 1
+                print(f'DHT read failed: {e}')
+            value = self.sampler.due()
+            if value is not None:
+                # queued for forward_telemetry(), never waits on the broker
+                self.telemetry.put('temp', int(round(value[0] * SCALE)))
+                self.telemetry.put('hum', int(round(value[1] * SCALE)))
+            await uasyncio.sleep(period)
+    
+    async def forward_telemetry(self, batch=8, rate_ms=500, late=60):
+        '''
+        Publish the queued telemetry, in batches of at most batch records
+        and at most one batch every rate_ms while catching up. Records
+        queued less than late seconds ago go to their topic, older ones
+        (kept during an outage) to prefix/telemetry as a json list of
+        [time, topic, value] along with the last value of each topic
+        '''
+        while True:
+            first, records = self.telemetry.peek(batch)
+            if not records:
+                self.telemetry.ready.clear()
+                await self.telemetry.ready.wait()
+                continue
+            if not self.client.isconnected():
+                await uasyncio.sleep(1)
+                continue
+            if utime.time() - records[0][0] <= late:
+                msgs = [(f'{self.topic_prefix}/{channel}', f'{value / SCALE}') for t, channel, value in records]
+            else:
+                latest = {}
+                for t, channel, value in records:
+                    latest[channel] = value
+                msgs = [(f'{self.topic_prefix}/telemetry',
+                         ujson.dumps([[self.date_time(t), channel, value / SCALE] for t, channel, value in records]))]
+                msgs += [(f'{self.topic_prefix}/{channel}', f'{value / SCALE}') for channel, value in latest.items()]
+            await self.client.publish_many(msgs, qos=1)
+            self.telemetry.drop(first + len(records))
+            if len(self.telemetry):
+                await uasyncio.sleep_ms(rate_ms)
+    
+    def dht_history(self):
+        '''
+        The DHT history as a json document: samples every interval seconds,
+        oldest first, in tenths of degree / percent, the last taken at end
+        '''
+        temps, hums = self.sampler.history()
+        return ujson.dumps({'interval': self.sampler.history_interval, 'end': self.date_time(self.sampler.history_at),
+                            'scale': SCALE, 'temp': temps, 'hum': hums})
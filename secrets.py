@@ -9,5 +9,6 @@ mqtt_config = {
     'ssl': True,
     'ssl_params': {'server_hostname': 'server_ip_address'},
     'queue_len': 1,
-    'clean': True
+    'clean': True,
+    'state_mode': 'topics' # or 'document': the state as one json on <topic_prefix>/state
 }
@@ -0,0 +1,92 @@
+from array import array
+import utime
+
+SCALE = 10 # fixed point: tenths of a degree / of a percent
+
+
+class Sampler:
+    '''
+    Temperature and humidity readings of the DHT sensor: median of the last
+    few samples, reported when they move past a deadband or after a max
+    interval, and kept every history_interval seconds in a ring buffer of
+    fixed point values
+    '''
+    
+    def __init__(self, window=5, temp_band=.3, hum_band=2.0, max_interval=900,
+                 history_interval=900, history_size=96):
+        # last raw samples, for the median
+        self.window = window
+        self.temps = array('h', [0] * window)
+        self.hums = array('h', [0] * window)
+        self.samples = 0
+        self.errors = 0
+    
+        self.temp_band = int(temp_band * SCALE)
+        self.hum_band = int(hum_band * SCALE)
+        self.max_interval = max_interval
+        self.reported = None # (temp, hum) last reported
+        self.reported_at = None
+    
+        # history, oldest first from head once full
+        self.history_interval = history_interval
+        self.history_temp = array('h', [0] * history_size)
+        self.history_hum = array('h', [0] * history_size)
+        self.head = 0
+        self.count = 0
+        self.history_at = None # time of the last entry
+    
+    def add(self, temp: float, hum: float, now=None):
+        '''
+        Record a raw sample, now is the local time in seconds (default RTC)
+        '''
+        now = utime.time() if now is None else now
+        i = self.samples % self.window
+        self.temps[i] = int(round(temp * SCALE))
+        self.hums[i] = int(round(hum * SCALE))
+        self.samples += 1
+    
+        if self.history_at is None or now - self.history_at >= self.history_interval:
+            temp, hum = self.median()
+            self.history_temp[self.head] = temp
+            self.history_hum[self.head] = hum
+            self.head = (self.head + 1) % len(self.history_temp)
+            self.count = min(self.count + 1, len(self.history_temp))
+            self.history_at = now
+    
+    def median(self):
+        '''
+        Median (fixed point) of the last samples
+        '''
+        n = min(self.samples, self.window)
+        if n == 0:
+            return None
+        temps = sorted(self.temps[:n])
+        hums = sorted(self.hums[:n])
+        return temps[n // 2], hums[n // 2]
+    
+    def due(self, now=None):
+        '''
+        Return the filtered (temp, hum) as floats if they must be reported,
+        i.e. moved past their deadband or were last reported max_interval
+        ago, None otherwise
+        '''
+        value = self.median()
+        if value is None:
+            return None
+        now = utime.time() if now is None else now
+        if self.reported is not None and now - self.reported_at < self.max_interval:
+            if (abs(value[0] - self.reported[0]) < self.temp_band
+                    and abs(value[1] - self.reported[1]) < self.hum_band):
+                return None
+        self.reported = value
+        self.reported_at = now
+        return value[0] / SCALE, value[1] / SCALE
+    
+    def history(self):
+        '''
+        History as (temps, hums), fixed point, oldest first
+        '''
+        size = len(self.history_temp)
+        start = (self.head - self.count) % size
+        order = [(start + i) % size for i in range(self.count)]
+        return [self.history_temp[i] for i in order], [self.history_hum[i] for i in order]
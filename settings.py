@@ -0,0 +1,113 @@
+import uos
+import ujson
+import ubinascii
+import uasyncio
+
+
+class Settings:
+    '''
+    Settings kept in a json file and written behind: update() only marks
+    them dirty and the run() task writes them once a burst of changes is
+    over. A write goes to a temporary file renamed over the old one (kept
+    as .bak) and carries a CRC of the content, so a crash or a corrupted
+    flash never leaves a half written file to load.
+    '''
+    
+    def __init__(self, path: str, delay_ms=2000):
+        self.path = path
+        self.delay_ms = delay_ms
+        self.values = {}
+        self.dirty = uasyncio.Event()
+        self.writes = 0
+    
+    @staticmethod
+    def encode(values: dict):
+        '''
+        json text of the values with a last "crc" entry, the CRC32 of the
+        text without it
+        '''
+        text = ujson.dumps(values)
+        body = text[1:-1]
+        return '{' + body + (', ' if body else '') + f'"crc": {ubinascii.crc32(text.encode())}' + '}'
+    
+    @staticmethod
+    def decode(text: str):
+        '''
+        Values of a json text, checked against its CRC if it has one (files
+        edited by hand need not)
+        '''
+        values = ujson.loads(text)
+        if 'crc' in values:
+            crc = values.pop('crc')
+            i = text.rindex('"crc": ')
+            body = text[:i]
+            if body.endswith(', '):
+                body = body[:-2]
+            if ubinascii.crc32((body + '}').encode()) != crc:
+                raise ValueError('CRC mismatch')
+        return values
+    
+    def load(self):
+        '''
+        Read the settings, from the backup of the previous write if the file
+        is missing or corrupted, and return them ({} if both are)
+        '''
+        for path in (self.path, self.path + '.bak'):
+            try:
+                with open(path, 'r') as f:
+                    self.values = self.decode(f.read())
+                return self.values
+            except (OSError, ValueError) as e:
+                print(f'Cannot load {path}: {e!r}')
+        self.values = {}
+        return self.values
+    
+    def update(self, values: dict):
+        '''
+        Change some settings, returns True if any of them changed i.e. a
+        write is due
+        '''
+        changed = False
+        for key, value in values.items():
+            if self.values.get(key) != value:
+                self.values[key] = value
+                changed = True
+        if changed:
+            self.dirty.set()
+        return changed
+    
+    def flush(self):
+        '''
+        Write the settings now
+        '''
+        self.dirty.clear()
+        tmp = self.path + '.tmp'
+        bak = self.path + '.bak'
+        with open(tmp, 'w') as f:
+            f.write(self.encode(self.values))
+        # the old file stays readable as the backup until the new one is in
+        # place (renaming over an existing file fails on FAT)
+        try:
+            uos.remove(bak)
+        except OSError:
+            pass
+        try:
+            uos.rename(self.path, bak)
+        except OSError:
+            pass
+        uos.rename(tmp, self.path)
+        self.writes += 1
+    
+    async def run(self):
+        '''
+        Write the settings a while after they changed, merging the changes
+        made in the meantime into a single write
+        '''
+        while True:
+            await self.dirty.wait()
+            await uasyncio.sleep_ms(self.delay_ms)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f'Error saving {self.path}: {e}')
+
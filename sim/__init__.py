@@ -0,0 +1,72 @@
+# Host-side simulation of the wake-up light.
+#
+# install() puts fake versions of the MicroPython and hardware modules
+# (machine, neopixel, utime, uasyncio, network, dht, usocket, ...) first on
+# sys.path, so light.py, sunrise.py, mqtt.py and lib/mqtt_as.py import
+# unchanged under CPython. Time is virtual: the event
+# loop jumps straight to the next timer when every task sleeps, and
+# sim.clock.CLOCK can be fast-forwarded. See sim/run.py to run the whole
+# app against the broker stand-in of sim/broker.py.
+
+import gc
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKES = os.path.join(ROOT, 'sim', 'fakes')
+
+# imported modules of the app, dropped by install() so they see the fakes
+APP_MODULES = ('startup', 'light', 'sunrise', 'settings', 'sensor', 'telemetry', 'mqtt', 'wifi', 'mqtt_as', 'wifi_manager', 'secrets')
+
+
+def install(epoch=None, realtime=False):
+    '''
+    Make the fake modules and the app importable. epoch sets the RTC and
+    the simulated UTC time (seconds since 2000-01-01), by default the
+    current host time; realtime makes the virtual clock follow the host
+    clock, e.g. for benchmarks of time-based code.
+    '''
+    for path in (os.path.join(ROOT, 'lib'), ROOT, FAKES):
+        if path in sys.path:
+            sys.path.remove(path)
+        sys.path.insert(0, path)
+    for name in APP_MODULES:
+        sys.modules.pop(name, None)
+    
+    from sim.clock import CLOCK
+    from sim.net import NET
+    if epoch is None:
+        import time
+        epoch = int(time.time()) - 946684800
+    CLOCK.reset(epoch, realtime)
+    NET.reset()
+    
+    # MicroPython's gc reports the heap, the host one does not
+    if not hasattr(gc, 'mem_free'):
+        gc.mem_free = lambda: 100000
+        gc.mem_alloc = lambda: 0
+    
+    # ptr8() of @micropython.viper code is a builtin there: on the host the
+    # buffers themselves index the same way
+    import builtins
+    builtins.ptr8 = _ptr
+    
+    import neopixel
+    neopixel.NeoPixel.instances.clear()
+    
+    # MicroPython str supports the buffer protocol, CPython str does not:
+    # let mqtt_as wrap the str topics and messages of the app
+    import mqtt_as
+    mqtt_as.memoryview = _memoryview
+    
+    import uasyncio
+    uasyncio.new_event_loop()
+    return CLOCK, NET
+
+
+def _ptr(buf):
+    return buf
+
+
+def _memoryview(obj):
+    return memoryview(obj.encode() if isinstance(obj, str) else obj)
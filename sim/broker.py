@@ -0,0 +1,173 @@
+# Minimal MQTT 3.1.1 broker on the virtual network: QoS 0/1 publish,
+# subscribe with + and # wildcards, ping. Replies arrive after rtt_ms of
+# virtual time, so latency-bound code can be measured.
+
+import struct
+
+import utime
+
+from sim.net import NET
+
+
+def topic_matches(pattern: str, topic: str):
+    p = pattern.split('/')
+    t = topic.split('/')
+    for i, level in enumerate(p):
+        if level == '#':
+            return True
+        if i >= len(t) or (level != '+' and level != t[i]):
+            return False
+    return len(p) == len(t)
+
+
+def _encode_len(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+
+def publish_packet(topic: str, payload: bytes, retain=False):
+    topic = topic.encode()
+    body = struct.pack('!H', len(topic)) + topic + payload
+    return bytes([0x30 | retain]) + _encode_len(len(body)) + body
+
+
+class Broker:
+    
+    def __init__(self, host='broker', port=1883, rtt_ms=0):
+        self.host = host
+        self.port = port
+        self.rtt_ms = rtt_ms
+        self.running = True
+        self.clients = {} # socket -> bytearray of pending input
+        self.subscriptions = {} # socket -> list of topic filters
+        self.published = [] # (ticks_ms, topic, payload, qos, retain) received from clients
+        self.packets = 0
+        self.drop_pubacks = 0 # number of PUBACKs to lose, to exercise resends
+        NET.listen(host, port, self)
+    
+    # connection handling, called by the virtual sockets
+    def accepted(self, sock):
+        if not self.running:
+            raise OSError(111) # ECONNREFUSED
+        self.clients[sock] = bytearray()
+        self.subscriptions[sock] = []
+    
+    def closed(self, sock):
+        self.clients.pop(sock, None)
+        self.subscriptions.pop(sock, None)
+    
+    def received(self, sock, data):
+        buf = self.clients.get(sock)
+        if buf is None:
+            return
+        buf.extend(data)
+        while True:
+            packet = self._take_packet(buf)
+            if packet is None:
+                return
+            self.packets += 1
+            self._handle(sock, *packet)
+    
+    def stop(self):
+        '''
+        Simulate a broker outage: drop every connection and refuse new ones
+        '''
+        self.running = False
+        for sock in list(self.clients):
+            sock.hangup()
+            self.closed(sock)
+    
+    def start(self):
+        self.running = True
+    
+    def publish(self, topic: str, payload, retain=False):
+        '''
+        Send a message to the subscribed clients, as if from another client
+        '''
+        if isinstance(payload, str):
+            payload = payload.encode()
+        packet = publish_packet(topic, payload, retain)
+        for sock, filters in self.subscriptions.items():
+            if any(topic_matches(f, topic) for f in filters):
+                sock.deliver(packet, self.rtt_ms / 2)
+    
+    def messages(self, topic=None):
+        return [m for m in self.published if topic is None or m[1] == topic]
+    
+    @staticmethod
+    def _take_packet(buf):
+        if len(buf) < 2:
+            return None
+        n = 0
+        shift = 0
+        i = 1
+        while True:
+            if i >= len(buf):
+                return None
+            b = buf[i]
+            n |= (b & 0x7F) << shift
+            i += 1
+            if not b & 0x80:
+                break
+            shift += 7
+        if len(buf) < i + n:
+            return None
+        header = buf[0]
+        body = bytes(buf[i:i + n])
+        del buf[:i + n]
+        return header, body
+    
+    def _reply(self, sock, data):
+        sock.deliver(data, self.rtt_ms)
+    
+    def _handle(self, sock, header, body):
+        kind = header & 0xF0
+        if kind == 0x10: # CONNECT
+            self._reply(sock, b'\x20\x02\x00\x00')
+        elif kind == 0x30: # PUBLISH
+            qos = (header >> 1) & 3
+            retain = header & 1
+            topic_len = struct.unpack('!H', body[:2])[0]
+            topic = body[2:2 + topic_len].decode()
+            i = 2 + topic_len
+            if qos:
+                pid = body[i:i + 2]
+                i += 2
+            payload = body[i:]
+            self.published.append((utime.ticks_ms(), topic, payload, qos, retain))
+            if qos:
+                if self.drop_pubacks > 0:
+                    self.drop_pubacks -= 1
+                else:
+                    self._reply(sock, b'\x40\x02' + pid)
+            self.publish(topic, payload, retain)
+        elif kind == 0x80: # SUBSCRIBE
+            pid = body[:2]
+            i = 2
+            codes = b''
+            while i < len(body):
+                n = struct.unpack('!H', body[i:i + 2])[0]
+                self.subscriptions[sock].append(body[i + 2:i + 2 + n].decode())
+                codes += bytes([body[i + 2 + n]])
+                i += 3 + n
+            self._reply(sock, b'\x90' + bytes([2 + len(codes)]) + pid + codes)
+        elif kind == 0xA0: # UNSUBSCRIBE
+            pid = body[:2]
+            i = 2
+            while i < len(body):
+                n = struct.unpack('!H', body[i:i + 2])[0]
+                topic = body[i + 2:i + 2 + n].decode()
+                if topic in self.subscriptions[sock]:
+                    self.subscriptions[sock].remove(topic)
+                i += 2 + n
+            self._reply(sock, b'\xb0\x02' + pid)
+        elif kind == 0xC0: # PINGREQ
+            self._reply(sock, b'\xd0\x00')
+        elif kind == 0xE0: # DISCONNECT
+            sock.hangup()
+            self.closed(sock)
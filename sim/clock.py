@@ -0,0 +1,82 @@
+# Virtual clock shared by the fake utime, machine.RTC and uasyncio modules.
+
+import math
+import time
+
+
+class VirtualClock:
+    '''
+    Monotonic clock in ns plus two wall clocks in seconds since 2000-01-01
+    (the MicroPython epoch on the ESP32): the device RTC, which the app
+    sets, and the true UTC time of the simulated world, which time servers
+    report. The device clocks (monotonic and RTC) run fast by drift ppm
+    compared with the world. In virtual mode time only moves when advanced,
+    e.g. by the event loop when every task is sleeping; in realtime mode it
+    follows the host clock.
+    '''
+    
+    def __init__(self, epoch=0, realtime=False):
+        self.realtime = realtime
+        self.ns = 0
+        self.rtc_offset_ns = epoch * 1000000000 # RTC ns at ns == 0
+        self.world_offset_ns = epoch * 1000000000 # UTC ns at ns == 0
+        self.drift = 0 # ppm
+        self._origin = time.monotonic_ns()
+    
+    def reset(self, epoch=0, realtime=False):
+        self.__init__(epoch, realtime)
+    
+    def monotonic_ns(self):
+        if self.realtime:
+            return time.monotonic_ns() - self._origin
+        return self.ns
+    
+    def monotonic(self):
+        return self.monotonic_ns() / 1e9
+    
+    def advance(self, seconds: float):
+        '''
+        Move virtual time forward (no-op in realtime mode)
+        '''
+        if not self.realtime and seconds > 0:
+            # round up so timers due at the new time do fire
+            self.ns += math.ceil(seconds * 1e9)
+    
+    def fast_forward(self, seconds: float):
+        self.advance(seconds)
+    
+    def time_ns(self):
+        '''
+        RTC in ns since 2000-01-01
+        '''
+        return self.rtc_offset_ns + self.monotonic_ns()
+    
+    def time(self):
+        '''
+        RTC in seconds since 2000-01-01
+        '''
+        return self.time_ns() // 1000000000
+    
+    def set_time(self, epoch: int, us=0):
+        '''
+        Set the RTC, to the microsecond
+        '''
+        self.rtc_offset_ns = epoch * 1000000000 + us * 1000 - self.monotonic_ns()
+    
+    def utc_ns(self, later_ms=0):
+        '''
+        True UTC time of the simulated world in ns, now or later_ms (device
+        time) from now
+        '''
+        ns = self.monotonic_ns() + int(later_ms * 1000000)
+        return self.world_offset_ns + ns - ns * self.drift // 1000000
+    
+    def utc(self):
+        return self.utc_ns() // 1000000000
+    
+    def set_utc(self, epoch: int):
+        ns = self.monotonic_ns()
+        self.world_offset_ns = epoch * 1000000000 - ns + ns * self.drift // 1000000
+
+
+CLOCK = VirtualClock()
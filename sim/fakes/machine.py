@@ -0,0 +1,95 @@
+# machine: pins, RTC (wall clock of the virtual clock) and friends.
+
+import utime
+
+from sim.clock import CLOCK
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._value = 0 if value is None else value
+        self.mode = mode
+    
+    def init(self, mode=-1, pull=-1, value=None):
+        self.mode = mode
+        if value is not None:
+            self._value = value
+    
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        self._value = 1 if v else 0
+    
+    def on(self):
+        self._value = 1
+    
+    def off(self):
+        self._value = 0
+    
+    def __call__(self, v=None):
+        return self.value(v)
+
+
+class RTC:
+    _memory = b''
+    
+    def datetime(self, dt=None):
+        '''
+        Get or set (year, month, day, weekday, hours, minutes, seconds, subseconds)
+        '''
+        if dt is None:
+            ns = CLOCK.time_ns()
+            t = utime.localtime(ns // 1000000000)
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], ns // 1000 % 1000000)
+        CLOCK.set_time(utime.mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0)), dt[7] if len(dt) > 7 else 0)
+    
+    def memory(self, data=None):
+        '''
+        RTC slow memory, survives soft resets
+        '''
+        if data is None:
+            return RTC._memory
+        RTC._memory = bytes(data)
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+    
+    def feed(self):
+        pass
+
+
+def bitstream(pin, encoding, timing, buf):
+    pass
+
+
+def unique_id():
+    return b'\x24\x0a\xc4\x00\x00\x01'
+
+
+def freq(hz=None):
+    return 240000000
+
+
+def reset():
+    raise SystemExit('machine.reset()')
+
+
+def soft_reset():
+    raise SystemExit('machine.soft_reset()')
+
+
+def reset_cause():
+    return 1 # PWRON_RESET
+
+
+def idle():
+    pass
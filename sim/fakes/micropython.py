@@ -0,0 +1,21 @@
+# micropython: const and the code emitter decorators are no-ops on the host.
+
+
+def const(x):
+    return x
+
+
+def native(f):
+    return f
+
+
+def viper(f):
+    return f
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(verbose=False):
+    pass
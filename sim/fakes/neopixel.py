@@ -0,0 +1,49 @@
+# neopixel: same buffer layout as the MicroPython driver, write() records
+# the frames sent to the strip.
+
+import utime
+
+
+class NeoPixel:
+    ORDER = (1, 0, 2, 3)
+    instances = [] # strips created so far, most recent last
+    
+    def __init__(self, pin, n, bpp=3, timing=1):
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.buf = bytearray(n * bpp)
+        self.pin.init(pin.OUT)
+        self.timing = timing
+        self.writes = 0
+        self.record = True
+        self.frames = [] # (ticks_ms, bytes of the buffer) of each write()
+        NeoPixel.instances.append(self)
+    
+    def __len__(self):
+        return self.n
+    
+    def __setitem__(self, i, v):
+        offset = i * self.bpp
+        for i in range(self.bpp):
+            self.buf[offset + self.ORDER[i]] = v[i]
+    
+    def __getitem__(self, i):
+        offset = i * self.bpp
+        return tuple(self.buf[offset + self.ORDER[i]] for i in range(self.bpp))
+    
+    def fill(self, v):
+        for i in range(self.n):
+            self[i] = v
+    
+    def write(self):
+        self.writes += 1
+        if self.record:
+            self.frames.append((utime.ticks_ms(), bytes(self.buf)))
+    
+    def pixel(self, frame: bytes, i: int):
+        '''
+        Color of led i in a recorded frame
+        '''
+        offset = i * self.bpp
+        return tuple(frame[offset + self.ORDER[k]] for k in range(self.bpp))
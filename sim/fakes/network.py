@@ -0,0 +1,57 @@
+# network: WLAN interfaces following the link state of the virtual network.
+
+from sim.net import NET
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+STAT_CONNECT_FAIL = 203
+
+
+class WLAN:
+    PM_NONE = 0
+    PM_PERFORMANCE = 1
+    PM_POWERSAVE = 2
+    
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connected = False
+        self._config = {'essid': '', 'hostname': 'esp32', 'pm': WLAN.PM_PERFORMANCE}
+    
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+    
+    def connect(self, ssid=None, password=None, **kwargs):
+        self._connected = NET.up and (ssid is None or not NET.ssids or ssid in NET.ssids)
+        if ssid is not None:
+            self._config['essid'] = ssid
+    
+    def disconnect(self):
+        self._connected = False
+    
+    def isconnected(self):
+        return NET.up and self._connected
+    
+    def status(self, param=None):
+        if param == 'rssi':
+            return -60
+        return STAT_GOT_IP if self.isconnected() else STAT_IDLE
+    
+    def scan(self):
+        return [(ssid.encode(), b'\x00' * 6, 1, -60, 3, False) for ssid in NET.ssids]
+    
+    def config(self, *args, **kwargs):
+        if args:
+            return self._config.get(args[0])
+        self._config.update(kwargs)
+    
+    def ifconfig(self, config=None):
+        return ('192.168.1.50', '255.255.255.0', '192.168.1.1', '192.168.1.1')
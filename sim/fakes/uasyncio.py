@@ -0,0 +1,122 @@
+# uasyncio on top of CPython asyncio, with an event loop driven by the
+# virtual clock: when every task sleeps the clock jumps to the next timer
+# instead of waiting, so hours of device time run in seconds.
+
+import asyncio as _asyncio
+import selectors as _selectors
+from asyncio import (CancelledError, Event, Lock, TimeoutError, gather,
+                     sleep, wait_for)
+
+from sim.clock import CLOCK
+
+
+class _VirtualSelector(_selectors.DefaultSelector):
+    
+    def select(self, timeout=None):
+        if CLOCK.realtime:
+            return super().select(timeout)
+        ready = super().select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:
+            # nothing scheduled: only real I/O can wake the loop
+            return super().select(None)
+        CLOCK.advance(timeout)
+        return []
+
+
+class VirtualTimeLoop(_asyncio.SelectorEventLoop):
+    
+    def __init__(self):
+        super().__init__(selector=_VirtualSelector())
+        self._clock_resolution = 1e-6
+    
+    def time(self):
+        return CLOCK.monotonic()
+
+
+_loop = None
+
+
+def get_event_loop():
+    global _loop
+    try:
+        return _asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    if _loop is None or _loop.is_closed():
+        _loop = VirtualTimeLoop()
+        _asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def new_event_loop():
+    global _loop
+    _loop = VirtualTimeLoop()
+    _asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def create_task(coro):
+    # like uasyncio, tasks can be created before the loop runs
+    return get_event_loop().create_task(coro)
+
+
+def run(coro):
+    return get_event_loop().run_until_complete(coro)
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+def current_task():
+    return _asyncio.current_task()
+
+
+class Stream:
+    '''
+    Reader and writer of a virtual socket, like the single Stream class of
+    uasyncio: reads poll the non-blocking socket
+    '''
+    
+    def __init__(self, sock):
+        self.s = sock
+    
+    async def read(self, n=-1):
+        while True:
+            data = self.s.read(n)
+            if data is not None:
+                return data
+            await sleep_ms(5)
+    
+    async def readline(self):
+        line = b''
+        while not line.endswith(b'\n'):
+            data = await self.read(1)
+            if not data:
+                break
+            line += data
+        return line
+    
+    def write(self, buf):
+        self.s.write(buf)
+    
+    async def drain(self):
+        pass
+    
+    def close(self):
+        self.s.close()
+    
+    async def wait_closed(self):
+        pass
+
+
+async def open_connection(host, port):
+    import usocket
+    addr = usocket.getaddrinfo(host, port)[0][-1]
+    s = usocket.socket()
+    s.setblocking(False)
+    s.connect(addr)
+    stream = Stream(s)
+    return stream, stream
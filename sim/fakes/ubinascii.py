@@ -0,0 +1,3 @@
+# ubinascii is binascii on the host.
+
+from binascii import *  # noqa: F401,F403
@@ -0,0 +1,3 @@
+# uerrno is errno on the host.
+
+from errno import *  # noqa: F401,F403
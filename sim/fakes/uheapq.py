@@ -0,0 +1,3 @@
+# uheapq is heapq on the host.
+
+from heapq import *  # noqa: F401,F403
@@ -0,0 +1,3 @@
+# uos is os on the host.
+
+from os import *  # noqa: F401,F403
@@ -0,0 +1,3 @@
+# uselect is select on the host.
+
+from select import *  # noqa: F401,F403
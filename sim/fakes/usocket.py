@@ -0,0 +1,16 @@
+# usocket: sockets of the virtual network (see sim.net).
+
+from sim.net import AF_INET, NET, SOCK_DGRAM, SOCK_STREAM, Socket
+
+SOL_SOCKET = 1
+SO_REUSEADDR = 4
+IPPROTO_UDP = 17
+
+
+def socket(af=AF_INET, type=SOCK_STREAM, proto=0):
+    return Socket(af, type, proto)
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    ip = NET.resolve(host)
+    return [(AF_INET, type or SOCK_STREAM, proto, '', (ip, port))]
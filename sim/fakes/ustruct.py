@@ -0,0 +1,3 @@
+# ustruct is struct on the host.
+
+from struct import *  # noqa: F401,F403
@@ -0,0 +1,62 @@
+# utime on top of the virtual clock. Wall clock functions use the MicroPython
+# epoch (2000-01-01) and localtime() tuples.
+
+import calendar as _calendar
+import time as _time
+
+from sim.clock import CLOCK
+
+TICKS_PERIOD = 1 << 30
+_TICKS_MAX = TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = TICKS_PERIOD // 2
+EPOCH_2000 = 946684800
+
+
+def ticks_ms():
+    return (CLOCK.monotonic_ns() // 1000000) & _TICKS_MAX
+
+
+def ticks_us():
+    return (CLOCK.monotonic_ns() // 1000) & _TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(end, start):
+    return ((end - start + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+def time():
+    return CLOCK.time()
+
+
+def time_ns():
+    return CLOCK.time_ns()
+
+
+def gmtime(secs=None):
+    t = _time.gmtime((time() if secs is None else int(secs)) + EPOCH_2000)
+    return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+
+localtime = gmtime # the RTC holds local time, as on the board
+
+
+def mktime(t):
+    return _calendar.timegm((t[0], t[1], t[2], t[3], t[4], t[5], 0, 0, 0)) - EPOCH_2000
+
+
+def sleep(seconds):
+    CLOCK.advance(seconds)
+    if CLOCK.realtime:
+        _time.sleep(seconds)
+
+
+def sleep_ms(ms):
+    sleep(ms / 1000)
+
+
+def sleep_us(us):
+    sleep(us / 1000000)
@@ -0,0 +1,199 @@
+# Virtual network: name resolution, servers reachable through the fake
+# usocket module, and the link state seen by the fake network.WLAN.
+
+import errno
+
+from sim.clock import CLOCK
+
+AF_INET = 2
+SOCK_STREAM = 1
+SOCK_DGRAM = 2
+
+
+class VirtualNetwork:
+    
+    def __init__(self):
+        self.up = True # WiFi link state
+        self.ssids = [] # networks seen by WLAN.scan()
+        self.hosts = {} # hostname -> ip
+        self.servers = {} # (ip, port, socket type) -> server
+    
+    def reset(self):
+        self.__init__()
+    
+    def add_host(self, name: str, ip: str):
+        self.hosts[name] = ip
+    
+    def resolve(self, host: str):
+        if not self.up:
+            raise OSError(-202) # lwip: name resolution failed
+        if host in self.hosts:
+            return self.hosts[host]
+        if host.replace('.', '').isdigit():
+            return host
+        raise OSError(-202)
+    
+    def listen(self, host: str, port: int, server, kind=SOCK_STREAM):
+        '''
+        Make a server reachable at host:port. A server implements
+        accepted(sock), received(sock, data) and closed(sock) for TCP,
+        datagram(sock, data) for UDP.
+        '''
+        ip = self.hosts.setdefault(host, host) if not host.replace('.', '').isdigit() else host
+        self.servers[(ip, port, kind)] = server
+    
+    def server(self, addr, kind):
+        if not self.up:
+            raise OSError(errno.EHOSTUNREACH)
+        server = self.servers.get((addr[0], addr[1], kind))
+        if server is None and kind == SOCK_STREAM:
+            raise OSError(errno.ECONNREFUSED)
+        return server
+
+
+NET = VirtualNetwork()
+
+
+class Socket:
+    '''
+    Client socket of the virtual network with the MicroPython semantics
+    used by the app: non-blocking read() returns None when no data is
+    ready, b'' once the peer closed the connection.
+    '''
+    
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0):
+        self.type = type
+        self.server = None
+        self.peer = None
+        self.blocking = True
+        self.timeout = None
+        self.rx = [] # (ready at ns, data)
+        self.peer_closed_at = None # ns
+        self.closed = False
+    
+    def setblocking(self, flag):
+        self.blocking = flag
+    
+    def settimeout(self, value):
+        self.timeout = value
+        self.blocking = value is None
+    
+    def connect(self, addr):
+        self.peer = addr
+        server = NET.server(addr, self.type)
+        if self.type == SOCK_STREAM:
+            self.server = server
+            server.accepted(self)
+        else:
+            self.server = server
+    
+    def _check(self):
+        if self.closed:
+            raise OSError(errno.EBADF)
+        if not NET.up:
+            raise OSError(errno.ECONNRESET)
+    
+    def write(self, data):
+        self._check()
+        if self.peer_closed:
+            raise OSError(errno.ECONNRESET)
+        data = bytes(data)
+        self.server.received(self, data)
+        return len(data)
+    
+    send = write
+    
+    def sendall(self, data):
+        self.write(data)
+    
+    def sendto(self, data, addr):
+        self._check()
+        server = NET.server(addr, SOCK_DGRAM)
+        if server is not None:
+            server.datagram(self, bytes(data), addr)
+        return len(data)
+    
+    def deliver(self, data: bytes, delay_ms=0, addr=None):
+        '''
+        Called by servers: data becomes readable after delay_ms, and not
+        before the data delivered earlier (streams keep their order)
+        '''
+        ready = CLOCK.monotonic_ns() + int(delay_ms * 1000000)
+        if self.rx:
+            ready = max(ready, self.rx[-1][0])
+        self.rx.append((ready, bytes(data), addr))
+    
+    def hangup(self, delay_ms=0):
+        '''
+        Called by servers to close the connection from their side, after
+        delay_ms e.g. once the last data delivered arrived
+        '''
+        self.peer_closed_at = CLOCK.monotonic_ns() + int(delay_ms * 1000000)
+    
+    @property
+    def peer_closed(self):
+        return self.peer_closed_at is not None and CLOCK.monotonic_ns() >= self.peer_closed_at
+    
+    def _ready(self):
+        now = CLOCK.monotonic_ns()
+        return [chunk for chunk in self.rx if chunk[0] <= now]
+    
+    def _wait_blocking(self):
+        # blocking sockets just move virtual time to the next chunk
+        if self.blocking and not self._ready() and self.rx:
+            CLOCK.advance((self.rx[0][0] - CLOCK.monotonic_ns()) / 1e9)
+    
+    def read(self, n=-1):
+        self._check()
+        self._wait_blocking()
+        if not self._ready():
+            if self.peer_closed:
+                return b''
+            if self.blocking:
+                raise OSError(errno.ETIMEDOUT)
+            return None
+        out = b''
+        while self.rx and self.rx[0][0] <= CLOCK.monotonic_ns() and (n < 0 or len(out) < n):
+            t, data, addr = self.rx.pop(0)
+            take = len(data) if n < 0 else min(len(data), n - len(out))
+            out += data[:take]
+            if take < len(data):
+                self.rx.insert(0, (t, data[take:], addr))
+        return out
+    
+    def recv(self, n):
+        data = self.read(n)
+        if data is None:
+            raise OSError(errno.EAGAIN)
+        return data
+    
+    def readinto(self, buf, n=-1):
+        n = len(buf) if n < 0 else n
+        data = self.read(n)
+        if data is None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+    
+    def recvfrom(self, n):
+        self._check()
+        self._wait_blocking()
+        if not self._ready():
+            raise OSError(errno.EAGAIN if not self.blocking else errno.ETIMEDOUT)
+        t, data, addr = self.rx.pop(0)
+        return data[:n], addr
+    
+    def readline(self):
+        out = b''
+        while not out.endswith(b'\n'):
+            c = self.read(1)
+            if not c:
+                break
+            out += c
+        return out
+    
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.type == SOCK_STREAM and self.server is not None:
+                self.server.closed(self)
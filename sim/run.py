@@ -0,0 +1,156 @@
+# Run the whole app (boot.py then main.py) on the host, in virtual time.
+#
+#   python -m sim.run --start 2024-03-01T06:55 --hours 1
+#
+# The files the app reads and writes (config.json, wifi.dat, ...) are
+# copied to a scratch directory standing in for the flash. A scenario
+# coroutine can drive the run, e.g. send commands through the broker.
+
+import os
+import shutil
+import sys
+import tempfile
+
+import sim
+
+FLASH_FILES = ('config.json', 'profiles.json', 'wifi.dat')
+
+
+class App:
+    '''
+    Handle on a simulated run: the globals of main.py (neo, neo_mqtt, ...),
+    the broker stand-in, the time servers, the virtual clock and network
+    '''
+    
+    def __init__(self, clock, net, broker, workdir):
+        self.clock = clock
+        self.net = net
+        self.broker = broker
+        self.workdir = workdir
+        self.globals = {'__name__': '__main__'}
+    
+    def __getattr__(self, name):
+        try:
+            return self.globals[name]
+        except KeyError:
+            raise AttributeError(name)
+    
+    @property
+    def strip(self):
+        import neopixel
+        return neopixel.NeoPixel.instances[-1]
+
+
+def _parse_start(text):
+    import calendar
+    import time
+    t = time.strptime(text, '%Y-%m-%dT%H:%M')
+    return calendar.timegm(t) - 946684800
+
+
+def _shutdown(loop):
+    '''
+    Cancel the tasks left on the loop main.py ran, so they can be
+    collected quietly
+    '''
+    import asyncio
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+    return len(tasks)
+
+
+def simulate(seconds: float, scenario=None, start=None, workdir=None, rtt_ms=20, quiet=False):
+    '''
+    Run the app for the given seconds of virtual time and return the App.
+    start is the initial local time, seconds since 2000-01-01 or
+    'YYYY-MM-DDTHH:MM'; scenario is an optional coroutine function called
+    with the App once main.py is running.
+    '''
+    if isinstance(start, str):
+        start = _parse_start(start)
+    clock, net = sim.install(epoch=start)
+    
+    own_workdir = workdir is None
+    workdir = tempfile.mkdtemp(prefix='wakeuplight-') if own_workdir else workdir
+    for name in FLASH_FILES:
+        src = os.path.join(sim.ROOT, name)
+        if os.path.exists(src) and not os.path.exists(os.path.join(workdir, name)):
+            shutil.copy(src, workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    
+    from secrets import mqtt_config
+    from sim.broker import Broker
+    from sim.servers import time_servers
+    try:
+        with open('wifi.dat') as f:
+            net.ssids = [line.split(';')[0] for line in f if ';' in line]
+    except OSError:
+        net.ssids = ['sim']
+    broker = Broker(mqtt_config['broker'], mqtt_config['port'], rtt_ms)
+    app = App(clock, net, broker, workdir)
+    app.time_servers = time_servers()
+    
+    import uasyncio
+    
+    async def driver():
+        try:
+            await uasyncio.sleep(0)
+            if scenario is not None:
+                await scenario(app)
+            remaining = seconds - (clock.monotonic() - t0)
+            if remaining > 0:
+                await uasyncio.sleep(remaining)
+        finally:
+            # stop the run even if the scenario fails
+            uasyncio.get_event_loop().stop()
+    
+    t0 = clock.monotonic()
+    loop = uasyncio.get_event_loop()
+    uasyncio.create_task(driver())
+    stdout = sys.stdout
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        for script in ('boot.py', 'main.py'):
+            with open(os.path.join(sim.ROOT, script)) as f:
+                code = compile(f.read(), script, 'exec')
+            try:
+                exec(code, app.globals)
+            except RuntimeError as e:
+                # the driver stops the loop main.py runs forever
+                if 'Event loop stopped' not in str(e):
+                    raise
+        _shutdown(loop)
+    finally:
+        if quiet:
+            sys.stdout.close()
+            sys.stdout = stdout
+        os.chdir(cwd)
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return app
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the wake-up light in virtual time')
+    parser.add_argument('--start', help='initial local time, YYYY-MM-DDTHH:MM')
+    parser.add_argument('--hours', type=float, default=1)
+    parser.add_argument('--rtt', type=float, default=20, help='broker round trip time in ms')
+    parser.add_argument('--quiet', action='store_true', help='hide the output of the app')
+    args = parser.parse_args(argv)
+    
+    app = simulate(args.hours * 3600, start=args.start, rtt_ms=args.rtt, quiet=args.quiet)
+    neo = app.neo
+    print(f'strip writes: {app.strip.writes}, frames written/suppressed: {neo.frames_written}/{neo.frames_suppressed}')
+    print(f'messages published: {len(app.broker.published)}, broker packets: {app.broker.packets}')
+    print(f'final color: {neo.current_color}')
+
+
+if __name__ == '__main__':
+    main()
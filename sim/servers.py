@@ -0,0 +1,44 @@
+# NTP servers on the virtual network, answering with the UTC time of the
+# simulated world after rtt_ms. Set down to make a server unreachable.
+
+import struct
+
+from sim.clock import CLOCK
+from sim.net import NET, SOCK_DGRAM
+
+NTP_DELTA = 3155673600
+
+
+class NTPServer:
+    
+    def __init__(self, host='pool.ntp.org', rtt_ms=30, stratum=2):
+        self.host = host
+        self.rtt_ms = rtt_ms
+        self.stratum = stratum
+        self.down = False
+        self.queries = 0
+        NET.listen(host, 123, self, SOCK_DGRAM)
+    
+    def datagram(self, sock, data, addr):
+        self.queries += 1
+        if self.down or len(data) < 48:
+            return
+        # the server reads its clock half way through the round trip
+        ns = CLOCK.utc_ns(self.rtt_ms / 2)
+        fraction = (ns % 1000000000) * (1 << 32) // 1000000000
+        stamp = struct.pack('!II', ns // 1000000000 + NTP_DELTA, fraction)
+        reply = bytearray(48)
+        reply[0] = 0x24 # version 4, server
+        reply[1] = self.stratum
+        reply[24:32] = data[40:48] # originate timestamp
+        reply[32:40] = stamp # receive
+        reply[40:48] = stamp # transmit
+        sock.deliver(reply, self.rtt_ms, addr)
+
+
+def time_servers():
+    '''
+    The time sources of sunrise.TIME_SOURCES, by host name
+    '''
+    servers = [NTPServer('pool.ntp.org'), NTPServer('time.google.com', rtt_ms=20)]
+    return {server.host: server for server in servers}
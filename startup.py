@@ -0,0 +1,27 @@
+import gc
+import utime
+
+
+class Startup:
+    '''
+    Record the ticks (ms since reset) and the free heap at each stage of
+    the startup, from boot.py to the MQTT connection
+    '''
+    
+    def __init__(self):
+        self.stages = []
+    
+    def mark(self, stage: str):
+        ms = utime.ticks_ms()
+        free = gc.mem_free()
+        self.stages.append((stage, ms, free))
+        print(f'Startup {stage}: {ms} ms, {free} bytes free')
+    
+    def report(self):
+        '''
+        Stages as a json list of [stage, ms, free heap]
+        '''
+        return '[' + ', '.join(f'["{stage}", {ms}, {free}]' for stage, ms, free in self.stages) + ']'
+
+
+STARTUP = Startup()
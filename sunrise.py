@@ -1,89 +1,816 @@
-import gc
-gc.enable()
-gc.collect()
-
 import utime
 import uasyncio
-import ntptime
-import urequests
+import uheapq
+import usocket
+import ustruct
+import uerrno
 from machine import RTC
-import ujson
+from settings import Settings
+from light import SCENE
+
+NTP_DELTA = 3155673600 # seconds from 1900-01-01 (NTP) to 2000-01-01
+# NTP servers queried in parallel, the first valid answer wins
+TIME_SOURCES = ('pool.ntp.org', 'time.google.com')
+SOCKET_POLL_MS = 20
+
+# address of each NTP server: getaddrinfo() blocks the whole loop, for
+# seconds when the internet is down, so a server is resolved only until
+# that succeeds once (as mqtt_as does for the broker)
+_addresses = {}
+
+
+async def ntp_time(host: str):
+    '''
+    UTC time (ms since 2000-01-01) from an NTP server, over a non-blocking
+    UDP socket polled from the event loop, as of the answer's arrival
+    '''
+    addr = _addresses.get(host)
+    if addr is None:
+        addr = usocket.getaddrinfo(host, 123)[0][-1]
+        _addresses[host] = addr
+    s = usocket.socket(usocket.AF_INET, usocket.SOCK_DGRAM)
+    s.setblocking(False)
+    try:
+        query = bytearray(48)
+        query[0] = 0x1B # version 3, client
+        sent = utime.ticks_ms()
+        s.sendto(query, addr)
+        while True:
+            try:
+                msg, _ = s.recvfrom(48)
+                break
+            except OSError as e:
+                if e.args[0] != uerrno.EAGAIN:
+                    raise
+            await uasyncio.sleep_ms(SOCKET_POLL_MS)
+    finally:
+        s.close()
+    rtt = utime.ticks_diff(utime.ticks_ms(), sent)
+    if len(msg) < 48:
+        raise ValueError(f'short NTP answer from {host}')
+    # server mode, not a kiss-o'-death (stratum 0) and a transmit time
+    seconds, fraction = ustruct.unpack('!II', msg[40:48])
+    if msg[0] & 7 != 4 or msg[1] == 0 or seconds == 0:
+        raise ValueError(f'invalid NTP answer from {host}')
+    # the server answered half way through the round trip
+    return (seconds - NTP_DELTA) * 1000 + (fraction >> 22) * 1000 // 1024 + rtt // 2
+
+
+class TimeZone:
+    '''
+    POSIX TZ rule, e.g. 'CET-1CEST,M3.5.0,M10.5.0/3': standard and DST
+    offsets (seconds east of UTC) and the Mm.w.d rules of the transitions.
+    The current offset is cached with the UTC times it holds between, so
+    offset() is a comparison until the next transition.
+    '''
+    
+    def __init__(self, spec: str):
+        self.spec = spec
+        i = self._name(spec, 0)
+        i, offset = self._time(spec, i)
+        self.std = -offset
+        self.dst = self.std
+        self.rules = None
+        if i < len(spec):
+            i = self._name(spec, i)
+            if i < len(spec) and spec[i] != ',':
+                i, offset = self._time(spec, i)
+                self.dst = -offset
+            else:
+                self.dst = self.std + 3600
+            if i >= len(spec) or spec[i] != ',':
+                raise ValueError(f'no DST rules in {spec}')
+            start, i = self._rule(spec, i + 1)
+            if i >= len(spec) or spec[i] != ',':
+                raise ValueError(f'no DST end rule in {spec}')
+            end, i = self._rule(spec, i + 1)
+            if i != len(spec):
+                raise ValueError(f'invalid timezone {spec}')
+            self.rules = (start, end)
+        self.current = self.std
+        self.since = None # UTC time range of the current offset
+        self.until = None
+    
+    @staticmethod
+    def _name(spec, i):
+        if spec[i:i + 1] == '<':
+            j = spec.index('>', i) + 1
+        else:
+            j = i
+            while j < len(spec) and spec[j].isalpha():
+                j += 1
+        if j - i < 3:
+            raise ValueError(f'invalid timezone name in {spec}')
+        return j
+    
+    @staticmethod
+    def _time(spec, i):
+        '''
+        [+-]hh[:mm[:ss]] at i, in seconds
+        '''
+        sign = 1
+        if spec[i:i + 1] in ('+', '-'):
+            sign = -1 if spec[i] == '-' else 1
+            i += 1
+        seconds = 0
+        for unit in (3600, 60, 1):
+            j = i
+            while j < len(spec) and spec[j].isdigit():
+                j += 1
+            if j == i:
+                raise ValueError(f'invalid time in {spec}')
+            seconds += int(spec[i:j]) * unit
+            i = j
+            if spec[i:i + 1] != ':':
+                break
+            i += 1
+        return i, sign * seconds
+    
+    @classmethod
+    def _rule(cls, spec, i):
+        '''
+        Mm.w.d[/time] at i: day d (0 is Sunday) of week w (5 is the last)
+        of month m, at time (default 02:00) local time
+        '''
+        if spec[i:i + 1] != 'M':
+            raise ValueError(f'only Mm.w.d rules are supported: {spec}')
+        j = i + 1
+        while j < len(spec) and spec[j] not in ',/':
+            j += 1
+        m, w, d = [int(x) for x in spec[i + 1:j].split('.')]
+        if not (1 <= m <= 12 and 1 <= w <= 5 and 0 <= d <= 6):
+            raise ValueError(f'invalid rule in {spec}')
+        t = 7200
+        if spec[j:j + 1] == '/':
+            j, t = cls._time(spec, j + 1)
+        return (m, w, d, t), j
+    
+    @staticmethod
+    def _date(year, rule):
+        '''
+        Local time (seconds since 2000-01-01) of a rule in a year
+        '''
+        m, w, d, t = rule
+        first = utime.mktime((year, m, 1, 0, 0, 0, 0, 0))
+        # utime weekdays start on Monday, POSIX ones on Sunday
+        day = (d - (utime.localtime(first)[6] + 1)) % 7 + (w - 1) * 7
+        while utime.localtime(first + day * 86400)[1] != m:
+            day -= 7
+        return first + day * 86400 + t
+    
+    def transitions(self, year: int):
+        '''
+        UTC times of the DST start and end in a year
+        '''
+        start, end = self.rules
+        return self._date(year, start) - self.std, self._date(year, end) - self.dst
+    
+    def offset(self, utc: int):
+        '''
+        Offset of local time at the given UTC time (seconds since 2000-01-01)
+        '''
+        if self.rules is None:
+            return self.std
+        if self.since is not None and self.since <= utc < self.until:
+            return self.current
+        year = utime.localtime(utc)[0]
+        changes = []
+        for y in (year, year + 1):
+            start, end = self.transitions(y)
+            changes += [(start, self.dst), (end, self.std)]
+        changes.sort()
+        if utc < changes[0][0]:
+            # from new year (no zone changes then) to the first transition
+            self.since = utime.mktime((year, 1, 1, 0, 0, 0, 0, 0)) - 86400
+            self.current = self.std if changes[0][1] == self.dst else self.dst
+            self.until = changes[0][0]
+        else:
+            for i in range(1, len(changes)):
+                if utc < changes[i][0]:
+                    self.since, self.current = changes[i - 1]
+                    self.until = changes[i][0]
+                    break
+        return self.current
+
+
+class DriftModel:
+    '''
+    Drift rate of the RTC in ppm, fitted from the clock offsets measured at
+    the syncs, and the sync interval keeping the clock error within
+    bound_ms. In between, the drift is corrected locally in steps of a
+    quarter of the bound.
+    '''
+    SAMPLES = 4 # syncs the rate is fitted on
+    
+    def __init__(self, bound_ms=1000, interval=3600, min_interval=600, max_interval=86400):
+        self.bound_ms = bound_ms
+        self.step_ms = max(1, bound_ms // 4)
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rate = 0 # ppm, positive when the RTC runs fast
+        self.samples = [] # (seconds, ms gained by the RTC) between syncs
+        self.synced_at = None # RTC seconds at the last sync
+        self.corrected = 0 # ms taken off the RTC since the last sync
+        self.stepped = 0 # ms taken off by syncs within min_interval
+        self.offset = None # ms, true time - RTC at the last sync
+        self.sampled = False # the last measure() ended an interval
+    
+    def measure(self, now: int, offset_ms: int):
+        '''
+        Account for the offset (true time - RTC, in ms) measured at RTC time
+        now, returns True if the RTC has to be set, after which clock_set()
+        is to be called
+        '''
+        self.offset = offset_ms
+        self.sampled = True
+        if self.synced_at is None:
+            return True
+        elapsed = now - self.synced_at
+        if elapsed < self.min_interval:
+            # too soon to tell drift from noise, e.g. a manual sync
+            self.sampled = False
+            return abs(offset_ms) > self.bound_ms
+        self.samples.append((elapsed, self.corrected + self.stepped - offset_ms))
+        self.samples = self.samples[-self.SAMPLES:]
+        self.rate = sum([d for _, d in self.samples]) * 1000 / sum([t for t, _ in self.samples])
+        # what is left is the error of the model
+        if abs(offset_ms) > self.bound_ms:
+            self.interval = max(self.min_interval, self.interval // 2)
+        elif abs(offset_ms) < self.bound_ms // 2:
+            self.interval = min(self.max_interval, self.interval * 2)
+        return True
+    
+    def clock_set(self, now: int):
+        '''
+        Account for the RTC set to the true time after measure(), now being
+        the RTC time once set: the interval starts from the corrected clock,
+        not from e.g. the 2000-01-01 of a cold boot
+        '''
+        if self.sampled:
+            self.restart(now)
+        else:
+            # a step within the interval is part of the next sample, but
+            # not of the local corrections of the model
+            self.stepped -= self.offset
+            self.synced_at += self.offset // 1000
+    
+    def restart(self, now: int):
+        '''
+        Start a new interval at RTC time now
+        '''
+        self.synced_at = now
+        self.corrected = 0
+        self.stepped = 0
+    
+    def correction(self, now: int):
+        '''
+        ms to take off the RTC at RTC time now, 0 until a step is due
+        '''
+        if self.synced_at is None:
+            return 0
+        due = int(self.rate * (now - self.synced_at) / 1000) - self.corrected
+        if abs(due) < self.step_ms:
+            return 0
+        self.corrected += due
+        return due
+    
+    def next_correction(self, now: int):
+        '''
+        Seconds from RTC time now to the next correction step, None if none
+        '''
+        if self.synced_at is None or self.rate == 0:
+            return None
+        target = self.corrected + (self.step_ms if self.rate > 0 else -self.step_ms)
+        # rounded up, at least a second: the RTC is read to the second
+        return max(1, self.synced_at + int(target * 1000 / self.rate) + 1 - now)
+
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+EVERY_DAY = 0x7F # weekday mask, bit 0 is Monday as in utime.localtime()
+DAY_SETS = {'daily': EVERY_DAY, 'weekdays': 0x1F, 'weekend': 0x60}
+
+
+def parse_days(days):
+    '''
+    Weekday mask of 'daily', 'weekdays', 'weekend', a comma separated string
+    or list of day names ('mon', 'tue', ...), or a mask already
+    '''
+    if isinstance(days, int):
+        return days & EVERY_DAY
+    if isinstance(days, str):
+        if days in DAY_SETS:
+            return DAY_SETS[days]
+        days = days.split(',')
+    mask = 0
+    for day in days:
+        mask |= 1 << DAYS.index(day.strip().lower()[:3])
+    return mask
+
+
+def day_names(mask: int):
+    return [DAYS[i] for i in range(7) if mask & 1 << i]
+
+
+class Alarm:
+    '''
+    A sunrise at hour:minute on the days of a weekday mask, with its own
+    profile and duration in seconds
+    '''
+    
+    def __init__(self, id: int, hour: int, minute: int, days=EVERY_DAY, profile='sunrise', delay=1200):
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f'invalid time {hour}:{minute}')
+        self.id = id
+        self.hour = hour
+        self.minute = minute
+        self.days = days
+        self.profile = profile
+        self.delay = delay
+    
+    @classmethod
+    def from_config(cls, id: int, c: dict):
+        '''
+        Alarm from its config.json (and add_alarm) form, e.g.
+        {"time": "06:30", "days": "weekdays", "profile": "sunrise", "delay": 20}
+        with the delay in minutes; id defaults to the given one and must be
+        a positive int, 0 is the daily alarm
+        '''
+        id = c.get('id', id)
+        if type(id) is not int or id < 1:
+            raise ValueError(f'invalid id {id}')
+        hour, minute = c['time'].split(':')
+        return cls(id, int(hour), int(minute), parse_days(c.get('days', EVERY_DAY)),
+                   c.get('profile', 'sunrise'), int(c.get('delay', 20)) * 60)
+    
+    def config(self):
+        return {'id': self.id, 'time': f'{self.hour:02d}:{self.minute:02d}',
+                'days': day_names(self.days),
+                'profile': self.profile, 'delay': self.delay // 60}
+    
+    def fire_at(self, now: int, lead=False):
+        '''
+        Local time (seconds since 2000-01-01) the next sunrise of the alarm
+        starts after now, None if it has no days. With lead, the sunrise
+        starts its delay earlier, to reach full light at the alarm time.
+        '''
+        return self._start(now, lead, 86400)
+    
+    def last_start(self, now: int, lead=False):
+        '''
+        Local time the latest sunrise of the alarm started at or before now,
+        None if it has no days
+        '''
+        return self._start(now, lead, -86400)
+    
+    def _start(self, now: int, lead: bool, step: int):
+        if not self.days & EVERY_DAY:
+            return None
+        t = utime.localtime(now)
+        # from yesterday's alarm time forward, tomorrow's backward: a lead
+        # start can be on the day before the alarm. The scan covers a whole
+        # week past the first start on the right side of now, however long
+        # the lead.
+        at = utime.mktime((t[0], t[1], t[2], self.hour, self.minute, 0, 0, 0)) - step
+        start = int(self.delay) if lead else 0
+        for _ in range(10 + start // 86400):
+            # the weekday is the one of the alarm, not of an earlier start
+            if (at - start > now if step > 0 else at - start <= now) and self.days & 1 << utime.localtime(at)[6]:
+                return at - start
+            at += step
+        return None
+
 
 class NeoPixelAlarm:
     
     def __init__(self, neopixel_obj):
         self.neo = neopixel_obj
         
+        self.settings = Settings('config.json')
+        c = self.settings.load()
+        self.utc_offset = c.get('utc_offset', 3600)
+        self.dst_offset = c.get('dst_offset', 0)
+        self.alarm_hour = c.get('alarm_hour', 6)
+        self.alarm_minute = c.get('alarm_minute', 15)
+        self.alarm_delay = c.get('sunrise_delay', 1200)
+        self.alarm_on = c.get('alarm_on', 1) == 1
+        self.daily_on = c.get('daily_alarm_on', 1) == 1
         try:
-            with open('config.json', 'r') as f:
-                c = ujson.load(f)
-                self.utc_offset = c['utc_offset']
-                self.dst_offset = c['dst_offset']
-                self.alarm_hour = c['alarm_hour']
-                self.alarm_minute = c['alarm_minute']
-                self.alarm_delay = c['sunrise_delay']
-                self.alarm_on = True if c['alarm_on'] == 1 else False
-                
-        except OSError as e:
-            print(f'Error alarm configs: {e}')
-            self.utc_offset = 3600
-            self.dst_offset = 0  
-            self.alarm_hour = 6
-            self.alarm_minute = 15
-            self.alarm_delay = 1200.0
-            self.alarm_on = True
+            self.alarm_days = parse_days(c.get('alarm_days', EVERY_DAY))
+        except (AttributeError, TypeError, ValueError) as e:
+            print(f'Invalid alarm days {c["alarm_days"]}: {e}')
+            self.alarm_days = EVERY_DAY
+        self.profile = c.get('sunrise_profile', 'sunrise')
+        self.lead = c.get('sunrise_lead', 0) == 1
+        self.time_error = c.get('time_error', 1)
+        self.tz = None
+        if c.get('timezone'):
+            try:
+                self.tz = TimeZone(c['timezone'])
+            except (ValueError, IndexError) as e:
+                print(f'Invalid timezone {c["timezone"]}: {e}')
+        self.alarms = []
+        for i, a in enumerate(c.get('alarms', [])):
+            try:
+                self.alarms.append(Alarm.from_config(i + 1, a))
+            except (KeyError, ValueError) as e:
+                print(f'Invalid alarm {a}: {e}')
         
+        self.synced = None
+        self.sync_source = None
+        self.syncing = False
+        self.drift = DriftModel(int(self.time_error * 1000))
+        self.next_sync = None
+        self.tz_changed = uasyncio.Event()
         self.alarm_running = False
+        # last alarm fired: id, start and end of its sunrise (local time),
+        # and whether it was dismissed or snoozed
+        self.fired_id = None
+        self.fired_at = None
+        self.ends_at = None
+        self.stopped = False
+        self.state = Settings('alarm.json', delay_ms=0)
+        self.load_state()
+        self.changed = uasyncio.Event()
+        self.changed.set()
+        self.schedule = {} # alarm id -> Alarm, as scheduled
+        self.queue = [] # heap of (next start, alarm id)
+        self.next_alarm = None
+        self.wakeups = 0
+        self.alarm_task = None
+        self.snooze_task = None
+        self.snooze_minutes = 9
 
-    def update_time(self):
+    async def update_time(self, timeout=5):
         '''
-        Update the local time via internet
+        Update the local time via internet: query the NTP servers in
+        parallel and set the clock from the first valid answer, within
+        timeout seconds. Returns the server used, None if none answered.
+        A sync already running is waited for instead of starting another.
         '''
-        try:
-            response = urequests.get('http://worldtimeapi.org/api/ip')
-            if response.status_code == 200:
-                print('API time updated')
-                parsed = response.json()
-                self.utc_offset = parsed['raw_offset']
-                self.dst_offset = parsed['dst_offset']
-                dt = utime.localtime(parsed['unixtime'] + self.utc_offset + self.dst_offset - 946684800)
-        except:
+        if self.syncing:
             try:
-                ntptime.settime()
-                dt = utime.localtime(utime.mktime(utime.localtime()) + self.utc_offset + self.dst_offset)
-                print('NTP time updated')
-            except:
-                print('Impossible to update time: no connection?')
-                dt = utime.gmtime(utime.time() + self.utc_offset + self.dst_offset)
-        
-        # save updated time as localtime
-        RTC().datetime((dt[0], dt[1], dt[2], dt[6] + 1, dt[3], dt[4], dt[5], 0))
-        print(dt)
+                await uasyncio.wait_for(self.synced.wait(), timeout)
+            except uasyncio.TimeoutError:
+                pass
+            return self.sync_source
+        self.syncing = True
+        self.synced = uasyncio.Event()
+        self.sync_source = None
+        tasks = [uasyncio.create_task(self.query_time(host)) for host in TIME_SOURCES]
+        try:
+            await uasyncio.wait_for(self.synced.wait(), timeout)
+        except uasyncio.TimeoutError:
+            print('Impossible to update time: no connection?')
+        finally:
+            self.syncing = False
+        for task in tasks:
+            task.cancel()
+        return self.sync_source
+    
+    async def query_time(self, host: str):
+        '''
+        Query one NTP server, set the clock if it is the first to answer
+        '''
+        try:
+            utc = await ntp_time(host)
+        except (OSError, ValueError, IndexError) as e:
+            print(f'Time source {host} failed: {e!r}')
+            return
+        if self.sync_source is not None:
+            return
+        self.sync_source = host
+        self.synced.set()
+        offset = utc - self.clock_ms()
+        self.update_offsets(utc // 1000)
+        if self.drift.measure(utime.time(), offset):
+            self.set_time(utc)
+            self.drift.clock_set(utime.time())
+        print(f'NTP time from {host}: clock offset {offset} ms, drift {self.drift.rate:.1f} ppm, next sync in {self.drift.interval} s')
+    
+    def set_timezone(self, spec: str):
+        '''
+        Follow the rules of a POSIX TZ string from now on (see TimeZone),
+        raises ValueError if it is invalid
+        '''
+        self.tz = TimeZone(spec)
+        self.update_offsets()
+        # the clock task waits for the next transition of the new rules
+        self.tz_changed.set()
+    
+    def set_offsets(self, utc_offset: int, dst_offset: int):
+        '''
+        Fixed UTC and DST offsets in seconds, instead of timezone rules
+        '''
+        self.tz = None
+        self.adjust_time((utc_offset + dst_offset - self.utc_offset - self.dst_offset) * 1000)
+        self.utc_offset = utc_offset
+        self.dst_offset = dst_offset
+    
+    def update_offsets(self, utc=None):
+        '''
+        Follow the timezone rules at the given UTC time (default the RTC's):
+        shift the RTC when the offset changes, e.g. at a DST transition.
+        Returns the local time of the next transition, None if none.
+        '''
+        if self.tz is None:
+            return None
+        if utc is None:
+            utc = self.clock_ms() // 1000
+        offset = self.tz.offset(utc)
+        shift = offset - self.utc_offset - self.dst_offset
+        self.utc_offset = self.tz.std
+        self.dst_offset = offset - self.tz.std
+        if shift:
+            print(f'Timezone {self.tz.spec}: UTC offset now {offset} s')
+            self.adjust_time(shift * 1000)
+        return None if self.tz.until is None else self.tz.until + offset
+    
+    def clock_ms(self):
+        '''
+        UTC time of the RTC, in ms since 2000-01-01
+        '''
+        return utime.time_ns() // 1000000 - (self.utc_offset + self.dst_offset) * 1000
+    
+    def set_time(self, utc_ms: int):
+        '''
+        Set the RTC to the local time of the given UTC time
+        '''
+        self.write_rtc(utc_ms + (self.utc_offset + self.dst_offset) * 1000)
+    
+    def adjust_time(self, ms: int):
+        '''
+        Move the RTC by ms
+        '''
+        self.write_rtc(utime.time_ns() // 1000000 + ms)
+    
+    def write_rtc(self, local_ms: int):
+        dt = utime.localtime(local_ms // 1000)
+        before = utime.time()
+        RTC().datetime((dt[0], dt[1], dt[2], dt[6] + 1, dt[3], dt[4], dt[5], local_ms % 1000 * 1000))
+        if abs(utime.time() - before) > 1:
+            print(dt)
+            # the clock stepped: the alarm is due at another time
+            self.reschedule()
 
-    async def call_update_time(self, delay=300):
+    async def call_update_time(self):
         '''
-        Async function to call update_time every 'delay' seconds
+        Async function keeping the clock on time: syncs at the interval of
+        the drift model, corrects the drift locally in between and follows
+        the DST transitions of the timezone
         '''
         while True:
-            self.update_time()
-            await uasyncio.sleep(delay)
+            if await self.update_time() is not None:
+                wait = self.drift.interval
+            elif self.drift.synced_at is None:
+                # not on time yet, e.g. no network at boot
+                wait = 60
+            else:
+                wait = self.drift.min_interval
+            self.next_sync = utime.time() + wait
+            while True:
+                self.tz_changed.clear()
+                transition = self.update_offsets()
+                now = utime.time()
+                if now >= self.next_sync:
+                    break
+                wait = self.next_sync - now
+                step = self.drift.next_correction(now)
+                if step is not None and step < wait:
+                    wait = step
+                if transition is not None and transition - now < wait:
+                    wait = max(1, transition - now)
+                try:
+                    await uasyncio.wait_for(self.tz_changed.wait(), wait)
+                except uasyncio.TimeoutError:
+                    pass
+                ms = self.drift.correction(utime.time())
+                if ms:
+                    self.adjust_time(-ms)
+    
+    def reschedule(self):
+        '''
+        Make the scheduler recompute the next alarm, to be called whenever
+        the alarm settings or the clock change
+        '''
+        self.changed.set()
+    
+    def load_state(self):
+        '''
+        Restore the last alarm fired, e.g. to resume its sunrise after a
+        reboot
+        '''
+        state = self.state.load()
+        self.fired_id = state.get('id')
+        self.fired_at = state.get('start')
+        self.ends_at = state.get('end')
+        self.stopped = state.get('stopped', 0) == 1
+    
+    def save_state(self):
+        self.state.update({'id': self.fired_id, 'start': self.fired_at, 'end': self.ends_at,
+                           'stopped': 1 if self.stopped else 0})
+    
+    def main_alarm(self):
+        '''
+        The daily alarm of the alarm_hour, alarm_minute, alarm_days, ...
+        settings
+        '''
+        return Alarm(0, self.alarm_hour, self.alarm_minute, self.alarm_days, self.profile, self.alarm_delay)
     
-    async def check_for_alarm(self, delay=.5):
+    def set_alarm_time(self, hour=None, minute=None):
+        '''
+        Change the time of the daily alarm, hour or minute left as they are
+        if None; raises ValueError, changing nothing, if out of range
+        '''
+        hour = self.alarm_hour if hour is None else hour
+        minute = self.alarm_minute if minute is None else minute
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f'invalid time {hour}:{minute}')
+        self.alarm_hour = hour
+        self.alarm_minute = minute
+        self.reschedule()
+    
+    def set_alarm_days(self, days):
+        '''
+        Change the days of the daily alarm, in any form parse_days() takes
+        '''
+        self.alarm_days = parse_days(days)
+        self.reschedule()
+    
+    def add_alarm(self, c: dict):
+        '''
+        Add an alarm from its config form (see Alarm.from_config) and
+        return it; with the id of an existing alarm, it replaces that one
+        '''
+        alarm = Alarm.from_config(max([a.id for a in self.alarms] + [0]) + 1, c)
+        if alarm.profile not in self.neo.profiles:
+            raise ValueError(f'unknown profile {alarm.profile}')
+        self.alarms = [a for a in self.alarms if a.id != alarm.id] + [alarm]
+        self.reschedule()
+        return alarm
+    
+    def remove_alarm(self, alarm_id: int):
+        '''
+        Remove an alarm, returns False if there is no such alarm
+        '''
+        alarms = [a for a in self.alarms if a.id != alarm_id]
+        if len(alarms) == len(self.alarms):
+            return False
+        self.alarms = alarms
+        self.reschedule()
+        return True
+    
+    def alarms_config(self):
+        return [a.config() for a in self.alarms]
+    
+    def rebuild(self, now: int):
+        '''
+        Compute the next start of every alarm into the heap, when the
+        settings or the clock change: the scheduler then only looks at its
+        top
+        '''
+        self.schedule = {}
+        self.queue = []
+        if self.alarm_on:
+            alarms = self.alarms
+            try:
+                if self.daily_on:
+                    alarms = [self.main_alarm()] + alarms
+            except ValueError as e:
+                # e.g. an out of range time in config.json: keep the others
+                print(f'Invalid daily alarm: {e}')
+            for alarm in alarms:
+                at = alarm.fire_at(now, self.lead)
+                if at is not None:
+                    self.schedule[alarm.id] = alarm
+                    self.queue.append((at, alarm.id))
+        uheapq.heapify(self.queue)
+    
+    def catch_up(self, now: int):
+        '''
+        Start the sunrise of an alarm whose window covers now, e.g. after a
+        reboot or a clock step, at its point on the curve - unless it is
+        already running or was dismissed or snoozed
+        '''
+        if self.alarm_running or not self.alarm_on:
+            return
+        for alarm in self.schedule.values():
+            start = alarm.last_start(now, self.lead)
+            if start is None or now >= start + alarm.delay:
+                continue
+            if start == self.fired_at and alarm.id == self.fired_id and self.stopped:
+                continue
+            print(f'Catching up with alarm {alarm.id}, {now - start} seconds in')
+            self.fire(alarm, start, now)
+            return
+    
+    def fire(self, alarm: Alarm, start: int, now: int):
+        '''
+        Record the alarm as fired at start and run its sunrise from now
+        '''
+        self.fired_id = alarm.id
+        self.fired_at = start
+        self.ends_at = start + int(alarm.delay)
+        self.stopped = False
+        self.save_state()
+        # running from now on, for the other alarms due at the same time
+        self.alarm_running = True
+        self.alarm_task = uasyncio.create_task(self.alarm(alarm, now - start))
+    
+    async def check_for_alarm(self):
+        '''
+        Async function triggering the alarms: sleeps until the next sunrise
+        is due, waking up earlier only to recompute it when the settings or
+        the clock change. The alarm_on setting switches all alarms,
+        daily_on only the daily one.
         '''
-        Async function to check when it is time to trigger the alarm
-        '''        
         while True:
-            now_hr = utime.localtime()[3]
-            now_mn = utime.localtime()[4]
-            
-            if self.alarm_on:
-                if (now_hr == self.alarm_hour) & (now_mn == self.alarm_minute) & (self.alarm_running is not True):
-                    self.alarm_running = True
-                    uasyncio.create_task(self.neo.sunrise(delay=self.alarm_delay))
-                # reset the alarm_run flag once the alarm is terminated
-                elif self.alarm_running:
-                    if (now_hr >= self.alarm_hour) & (now_mn > (self.alarm_minute + self.alarm_delay / 60)):
-                        self.alarm_running = False
-            
-            await uasyncio.sleep(delay)
-            
\ No newline at end of file
+            now = utime.time()
+            if self.changed.is_set():
+                self.changed.clear()
+                self.rebuild(now)
+                self.catch_up(now)
+            at = self.queue[0][0] if self.queue else None
+            if at != self.next_alarm:
+                self.next_alarm = at
+                print(f'Next alarm at {utime.localtime(at) if at is not None else None}')
+            try:
+                if at is None:
+                    await self.changed.wait()
+                else:
+                    # at most a day at a time: a wait of a week overflows
+                    # the ticks_ms range of uasyncio
+                    await uasyncio.wait_for(self.changed.wait(), min(at - now, 86400))
+            except uasyncio.TimeoutError:
+                pass
+            self.wakeups += 1
+            # settings changed, or the timer ended just before the RTC second
+            # ticked over
+            now = utime.time()
+            if self.changed.is_set() or at is None or now < at:
+                continue
+            while self.queue and self.queue[0][0] <= now:
+                alarm_id = self.queue[0][1]
+                alarm = self.schedule[alarm_id]
+                if not self.alarm_running:
+                    self.fire(alarm, self.queue[0][0], now)
+                # the next start of the same alarm replaces it in the heap
+                uheapq.heappop(self.queue)
+                at = alarm.fire_at(now, self.lead)
+                if at is None:
+                    del self.schedule[alarm_id]
+                else:
+                    uheapq.heappush(self.queue, (at, alarm_id))
+    
+    async def alarm(self, alarm: Alarm, elapsed=0):
+        '''
+        Run the sunrise of an alarm, elapsed seconds into it
+        '''
+        print(f'Alarm {alarm.id} at {alarm.hour:02d}:{alarm.minute:02d}')
+        try:
+            await self.neo.sunrise(delay=alarm.delay, profile=alarm.profile, elapsed=elapsed)
+        finally:
+            # a sunrise replaced by a later one leaves the flag to it
+            if self.alarm_task is uasyncio.current_task():
+                self.alarm_running = False
+    
+    def stop(self):
+        '''
+        Mark the last alarm as handled by the user, so it is not resumed
+        '''
+        if self.ends_at is not None and not self.stopped and utime.time() < self.ends_at:
+            self.stopped = True
+            self.save_state()
+    
+    def dismiss(self):
+        '''
+        Stop the running sunrise, if any, and forget a snoozed one
+        '''
+        self.stop()
+        if self.snooze_task is not None:
+            self.snooze_task.cancel()
+            self.snooze_task = None
+        state = self.neo.animation_state()
+        if state is not None and state[0] in self.neo.profiles:
+            self.neo.cancel()
+    
+    def snooze(self, minutes=None):
+        '''
+        Switch off the running sunrise and resume it where it was after the
+        given minutes
+        '''
+        minutes = self.snooze_minutes if minutes is None else minutes
+        animation = self.neo.animations[SCENE]
+        if animation is None or animation.name not in self.neo.profiles:
+            return
+        elapsed = animation.elapsed(utime.ticks_ms()) / 1000
+        delay = animation.duration / 1000
+        self.stop()
+        self.neo.off()
+        print(f'Snoozing {animation.name} for {minutes} minutes')
+        self.snooze_task = uasyncio.create_task(self.resume_after(minutes * 60, animation.name, delay, elapsed))
+    
+    async def resume_after(self, seconds: float, profile: str, delay: float, elapsed: float):
+        await uasyncio.sleep(seconds)
+        self.snooze_task = None
+        await self.neo.sunrise(delay=delay, profile=profile, elapsed=elapsed)
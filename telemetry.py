@@ -0,0 +1,155 @@
+import uos
+import ustruct
+import utime
+import uasyncio
+
+RECORD = '<IBh' # local time, channel, value (fixed point)
+RECORD_SIZE = ustruct.calcsize(RECORD)
+
+
+class Telemetry:
+    '''
+    Outbound telemetry waiting to be published: timestamped records in a
+    preallocated ring buffer, put() without ever waiting on the network.
+    When the ring fills up (a long broker outage) its older half is spilled
+    to a binary file on flash, forwarded first once the broker is back.
+    Records are numbered in order and only ever leave from the oldest, so
+    that the forwarder can drop the ones it published even if the buffer
+    moved or discarded records meanwhile.
+    '''
+    
+    def __init__(self, channels, size=64, path='telemetry.bin', max_spill=4096):
+        self.channels = tuple(channels)
+        self.size = size
+        self.buf = bytearray(size * RECORD_SIZE)
+        self.head = 0 # oldest record of the ring
+        self.count = 0
+        self.path = path
+        self.max_spill = max_spill
+        self.first = 0 # number of the oldest record, in the file or the ring
+        self.dropped = 0 # discarded, possibly while being published
+        self.ready = uasyncio.Event()
+        # records left in the file by a previous run are forwarded too
+        try:
+            self.spilled = uos.stat(path)[6] // RECORD_SIZE
+        except OSError:
+            self.spilled = 0
+        self.spill_pos = 0 # records of the file already forwarded
+        if self.spilled:
+            self.ready.set()
+    
+    def __len__(self):
+        return self.spilled - self.spill_pos + self.count
+    
+    def put(self, channel: str, value: int, now=None):
+        '''
+        Queue a value of a channel, now is its local time in seconds
+        (default RTC)
+        '''
+        if self.count == self.size:
+            self.spill(self.size // 2)
+        now = utime.time() if now is None else now
+        i = (self.head + self.count) % self.size
+        ustruct.pack_into(RECORD, self.buf, i * RECORD_SIZE, now, self.channels.index(channel), value)
+        self.count += 1
+        self.ready.set()
+    
+    def spill(self, n: int):
+        '''
+        Move the n oldest records of the ring to the end of the file. When
+        the file is full its oldest records make room, the newest readings
+        are kept; if it cannot be written, it is given up together with
+        these records
+        '''
+        try:
+            pending = self.spilled - self.spill_pos
+            if pending + n > self.max_spill:
+                self.discard(pending + n - self.max_spill)
+            if self.spill_pos:
+                self.compact()
+            buf = memoryview(self.buf)
+            # at most two writes, the ring may wrap around
+            first = min(n, self.size - self.head)
+            with open(self.path, 'ab') as f:
+                f.write(buf[self.head * RECORD_SIZE:(self.head + first) * RECORD_SIZE])
+                if n > first:
+                    f.write(buf[:(n - first) * RECORD_SIZE])
+            self.spilled += n
+            self.head = (self.head + n) % self.size
+            self.count -= n
+        except OSError as e:
+            print(f'Error spilling telemetry: {e}')
+            self.discard(self.spilled - self.spill_pos + n)
+            try:
+                uos.remove(self.path)
+            except OSError:
+                pass
+            self.spilled = self.spill_pos = 0
+    
+    def compact(self):
+        '''
+        Rewrite the file without the records already forwarded or
+        discarded, a chunk at a time
+        '''
+        tmp = self.path + '.tmp'
+        left = self.spilled - self.spill_pos
+        with open(self.path, 'rb') as src:
+            src.seek(self.spill_pos * RECORD_SIZE)
+            with open(tmp, 'wb') as dst:
+                while left:
+                    chunk = min(left, 32)
+                    dst.write(src.read(chunk * RECORD_SIZE))
+                    left -= chunk
+        uos.remove(self.path)
+        uos.rename(tmp, self.path)
+        self.spilled -= self.spill_pos
+        self.spill_pos = 0
+    
+    def discard(self, n: int):
+        '''
+        Lose the n oldest records, from the file first
+        '''
+        self.dropped += n
+        self.drop(self.first + n)
+    
+    def peek(self, n: int):
+        '''
+        Return the number of the oldest record and up to n records
+        (time, channel, value) from it, oldest first
+        '''
+        records = []
+        if self.spill_pos < self.spilled:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.spill_pos * RECORD_SIZE)
+                    data = f.read(min(n, self.spilled - self.spill_pos) * RECORD_SIZE)
+            except OSError as e:
+                # the spilled records are lost, go on with the ring
+                print(f'Error reading telemetry: {e}')
+                self.discard(self.spilled - self.spill_pos)
+                data = b''
+            for i in range(0, len(data), RECORD_SIZE):
+                records.append(ustruct.unpack_from(RECORD, data, i))
+        for i in range(min(n - len(records), self.count)):
+            records.append(ustruct.unpack_from(RECORD, self.buf, (self.head + i) % self.size * RECORD_SIZE))
+        return self.first, [(t, self.channels[c], value) for t, c, value in records]
+    
+    def drop(self, upto: int):
+        '''
+        Forget the records numbered below upto, i.e. published
+        '''
+        n = upto - self.first
+        if n <= 0:
+            return
+        self.first = upto
+        from_file = min(n, self.spilled - self.spill_pos)
+        self.spill_pos += from_file
+        if self.spill_pos >= self.spilled and self.spilled:
+            try:
+                uos.remove(self.path)
+            except OSError:
+                pass
+            self.spilled = self.spill_pos = 0
+        n = min(n - from_file, self.count)
+        self.head = (self.head + n) % self.size
+        self.count -= n